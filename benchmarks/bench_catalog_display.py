@@ -0,0 +1,71 @@
+"""
+Throughput of the Sales ``GET /goods`` display path with the catalog cache off and on.
+
+Readers hit ``display_goods`` while the catalog replica is not ready, so every read goes to
+a stubbed inventory service that answers after ``--delay`` ms with ``--goods`` goods. With
+the cache off each read pays the call and filters the whole list; with it on, reads within
+the TTL are served from memory and later ones are revalidated in the background.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_catalog_display --threads 8 --reads 200 --goods 5000 --delay 20
+"""
+import argparse
+import contextlib
+import io
+import statistics
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import Sales.app as sales
+from Sales.app import app, CatalogCache
+
+
+def run(label, cache, threads, reads):
+    sales.catalog_cache = cache
+    latencies = []
+
+    def reader():
+        client = app.test_client()
+        for _ in range(reads):
+            start = time.perf_counter()
+            response = client.get("/goods")
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200
+
+    pool = [threading.Thread(target=reader) for _ in range(threads)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # display_goods is wrapped in memory_profiler's report
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+    elapsed = time.perf_counter() - start
+
+    ms = sorted(latency * 1000 for latency in latencies)
+    stats = cache.stats()
+    print(f"{label:>9}: {len(ms) / elapsed:8.1f} reads/s  p50 {statistics.median(ms):7.2f} ms  "
+          f"p99 {ms[int(len(ms) * 0.99) - 1]:7.2f} ms  hit ratio {stats['hit_ratio']:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--reads", type=int, default=200, help="reads per thread")
+    parser.add_argument("--goods", type=int, default=5000)
+    parser.add_argument("--delay", type=float, default=20, help="ms per inventory call")
+    args = parser.parse_args()
+
+    goods = [{"id": i, "name": f"good-{i}", "category": "food", "price_per_item": 1.0,
+              "description": "", "count_in_stock": i % 3} for i in range(args.goods)]
+
+    def get(session, url, *a, **kw):
+        time.sleep(args.delay / 1000)
+        return MagicMock(status_code=200, json=MagicMock(return_value=goods))
+
+    sales.limiter.enabled = False
+    with patch.object(sales.requests.Session, "get", get):
+        run("cache off", CatalogCache(0, 0, 0), args.threads, args.reads)
+        run("cache on", CatalogCache(app.config['CATALOG_CACHE_SIZE'] or 1000, app.config['CATALOG_CACHE_TTL'],
+                                     app.config['CATALOG_CACHE_STALE_SECONDS']), args.threads, args.reads)
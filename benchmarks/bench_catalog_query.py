@@ -0,0 +1,97 @@
+"""
+Latency benchmark of ``/goods/query`` on a large catalog, with the query plan of each case.
+
+The goods table is filled up to ``--goods`` rows (1M by default) spread over the four
+categories, with random prices and about one good in ten sold out. Each case runs the
+first page (which also computes the category facets) and a later keyset page.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_catalog_query --goods 1000000 --repeat 20
+
+The database is taken from ``SQLALCHEMY_DATABASE_URI`` like the service itself. Rows are
+added once and kept, so later runs skip the seeding.
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import insert
+
+import inventory.app as inventory
+from inventory.app import app, db, Goods, build_goods_query, build_category_facets
+
+CATEGORIES = ['food', 'clothes', 'accessories', 'electronics']
+
+CASES = [
+    ("electronics under $500, in stock, by price", "category=electronics&max_price=500&in_stock=true&sort=price"),
+    ("all goods by price, descending", "sort=-price"),
+    ("food between $5 and $10", "category=food&min_price=5&max_price=10&sort=price"),
+    ("sold out clothes by id", "category=clothes&in_stock=false"),
+]
+
+
+def seed(goods, batch_size=10000):
+    with app.app_context():
+        db.create_all()
+        existing = db.session.execute(db.select(db.func.count(Goods.id))).scalar()
+        rng = random.Random(42)
+        for start in range(existing, goods, batch_size):
+            db.session.execute(insert(Goods), [
+                {
+                    "name": f"bench-good-{i:07d}",
+                    "category": rng.choice(CATEGORIES),
+                    "price_per_item": round(rng.uniform(0.5, 2000), 2),
+                    "description": "",
+                    "count_in_stock": 0 if rng.random() < 0.1 else rng.randint(1, 500)
+                }
+                for i in range(start, min(start + batch_size, goods))
+            ])
+            db.session.commit()
+        if db.engine.dialect.name == 'mysql':
+            db.session.execute(db.text('ANALYZE TABLE goods'))
+        elif db.engine.dialect.name == 'sqlite':
+            db.session.execute(db.text('ANALYZE'))
+        return max(existing, goods)
+
+
+def query_plan(query):
+    sql = str(query.compile(db.engine, compile_kwargs={"literal_binds": True}))
+    if db.engine.dialect.name == 'sqlite':
+        return ' | '.join(row[-1] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}')))
+    rows = db.session.execute(db.text(f'EXPLAIN {sql}')).mappings().all()
+    return ' | '.join(f"{row['type']}:{row['key']}" for row in rows)
+
+
+def timed(url, repeat):
+    with app.test_request_context(url):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            response, status = inventory.query_goods()
+        return (time.perf_counter() - start) / repeat * 1000, response.json
+
+
+def run(repeat):
+    for label, args in CASES:
+        first_ms, page = timed(f"/goods/query?{args}", repeat)
+        next_ms = 0.0
+        if page["next_cursor"]:
+            next_ms, _ = timed(f"/goods/query?{args}&cursor={page['next_cursor']}", repeat)
+        print(f"{label}: first page {first_ms:8.2f} ms (with facets)  next page {next_ms:8.2f} ms")
+
+        with app.test_request_context(f"/goods/query?{args}"):
+            from flask import request
+            query, _ = build_goods_query(request.args)
+            print(f"    page plan:   {query_plan(query.limit(50))}")
+            print(f"    facets plan: {query_plan(build_category_facets(request.args))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--goods", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    inventory.limiter.enabled = False
+    print(f"{seed(args.goods)} goods")
+    run(args.repeat)
@@ -0,0 +1,88 @@
+"""
+Concurrent login benchmark with password hashing inline and in the worker pool.
+
+A burst of threads calls the ``login`` view at once, the way a threaded server handles a
+login storm, while one more thread keeps hitting ``get_customer_by_username``. The report
+shows login throughput and how long the cheap read waits behind the hashing work.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_login --threads 16 --logins 20
+
+The database is taken from ``SQLALCHEMY_DATABASE_URI`` like the service itself.
+"""
+import argparse
+import statistics
+import threading
+import time
+
+import customers.app as customers
+from customers.app import app, db, Customer, PasswordHasher
+
+USERNAME = "loginbench"
+PASSWORD = "correct horse battery staple"
+
+
+def setup():
+    with app.app_context():
+        db.create_all()
+        c = Customer.query.filter_by(username=USERNAME).first()
+        if c is None:
+            c = Customer("Login", "Bench", USERNAME, PASSWORD, 30, "1 Benchmark Street", "other", "single")
+            db.session.add(c)
+        c.password = customers.password_hasher.hash(PASSWORD)
+        db.session.commit()
+
+
+def login_worker(logins, results):
+    for _ in range(logins):
+        with app.test_request_context(json={"username": USERNAME, "password": PASSWORD}):
+            results.append(app.make_response(customers.login()).status_code)
+
+
+def run(workers, threads, logins):
+    app.config['PASSWORD_HASH_WORKERS'] = workers
+    app.config['PASSWORD_HASH_MAX_PENDING'] = threads * 2
+    customers.password_hasher = PasswordHasher()
+
+    results, read_latencies = [], []
+    done = threading.Event()
+
+    def reader():
+        while not done.is_set():
+            with app.test_request_context():
+                start = time.perf_counter()
+                customers.get_customer_by_username(USERNAME)
+                read_latencies.append(time.perf_counter() - start)
+
+    pool = [threading.Thread(target=login_worker, args=(logins, results)) for _ in range(threads)]
+    probe = threading.Thread(target=reader)
+    start = time.perf_counter()
+    probe.start()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    probe.join()
+
+    label = f"pool x{workers}" if workers else "inline"
+    ok = sum(1 for status in results if status == 200)
+    read_ms = sorted(latency * 1000 for latency in read_latencies)
+    p99 = read_ms[int(len(read_ms) * 0.99) - 1] if read_ms else 0.0
+    print(f"{label:>9}: {len(results) / elapsed:7.1f} logins/s ({ok}/{len(results)} ok)  "
+          f"reads p50 {statistics.median(read_ms) if read_ms else 0.0:6.2f} ms  p99 {p99:6.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--logins", type=int, default=20, help="logins per thread")
+    parser.add_argument("--workers", type=int, default=app.config['PASSWORD_HASH_WORKERS'] or 4)
+    args = parser.parse_args()
+
+    customers.limiter.enabled = False
+    setup()
+    run(0, args.threads, args.logins)
+    run(args.workers, args.threads, args.logins)
@@ -0,0 +1,53 @@
+"""
+Read-path benchmark of ``get_customer_by_username`` with the profile cache on and off.
+
+The view is called inside a request context, the way Sales hits it on every purchase,
+so the numbers cover the cache lookup or the database round trips plus serialization.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_profile_cache --requests 5000
+
+The database is taken from ``SQLALCHEMY_DATABASE_URI`` like the service itself.
+"""
+import argparse
+import time
+
+import customers.app as customers
+from customers.app import app, db, Customer, ProfileCache, LocalInvalidationBus
+
+USERNAME = "profilebench"
+
+
+def setup():
+    with app.app_context():
+        db.create_all()
+        if Customer.query.filter_by(username=USERNAME).first() is None:
+            db.session.add(Customer("Profile", "Bench", USERNAME, "password",
+                                    30, "1 Benchmark Street", "other", "single"))
+            db.session.commit()
+
+
+def run(cache_size, requests):
+    customers.profile_cache = ProfileCache(cache_size, app.config['PROFILE_CACHE_TTL'], LocalInvalidationBus())
+    with app.test_request_context():
+        customers.get_customer_by_username(USERNAME)  # warm up
+        start = time.perf_counter()
+        for _ in range(requests):
+            customers.get_customer_by_username(USERNAME)
+        elapsed = time.perf_counter() - start
+
+    label = "cache on" if cache_size else "cache off"
+    print(f"{label:>9}: {elapsed / requests * 1e6:8.1f} us/request  {requests / elapsed:9.1f} requests/s  "
+          f"{customers.profile_cache.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    customers.limiter.enabled = False
+    setup()
+    run(0, args.requests)
+    run(app.config['PROFILE_CACHE_SIZE'] or 10000, args.requests)
@@ -0,0 +1,120 @@
+"""
+Latency benchmark of ``/purchase_history`` on a large purchase table, with the query plan of each case.
+
+The purchase table is filled up to ``--purchases`` rows (10M by default) spread over
+``--customers`` customers across two years. Each case reads the history of one customer:
+the first page, a page deep in the history through the keyset cursor, a one-month date
+range, and the whole history streamed as NDJSON.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_purchase_history --purchases 10000000 --customers 100000 --repeat 20
+
+The database is taken from ``SQLALCHEMY_DATABASE_URI`` like the service itself. Rows are
+added once and kept, so later runs skip the seeding.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import random
+import time
+
+import jwt
+from sqlalchemy import insert
+
+import Sales.app as sales
+from Sales.app import app, db, Purchase, SECRET_KEY, build_purchase_history, migrate_purchase_history_index
+
+START = datetime.datetime(2023, 1, 1)
+SPAN_SECONDS = 2 * 365 * 24 * 3600
+
+
+def username(i):
+    return f"bench-customer-{i:07d}"
+
+
+def seed(purchases, customers, batch_size=10000):
+    with app.app_context():
+        db.create_all()
+        migrate_purchase_history_index()
+        existing = db.session.execute(db.select(db.func.count(Purchase.id))).scalar()
+        rng = random.Random(42)
+        for start in range(existing, purchases, batch_size):
+            db.session.execute(insert(Purchase), [
+                {
+                    "customer_username": username(rng.randrange(customers)),
+                    "good_name": f"bench-good-{rng.randrange(10000):05d}",
+                    "purchase_date": START + datetime.timedelta(seconds=rng.randrange(SPAN_SECONDS)),
+                    "price": round(rng.uniform(0.5, 2000), 2)
+                }
+                for _ in range(start, min(start + batch_size, purchases))
+            ])
+            db.session.commit()
+        if db.engine.dialect.name == 'mysql':
+            db.session.execute(db.text('ANALYZE TABLE purchase'))
+        elif db.engine.dialect.name == 'sqlite':
+            db.session.execute(db.text('ANALYZE'))
+        return max(existing, purchases)
+
+
+def query_plan(query):
+    sql = str(query.compile(db.engine, compile_kwargs={"literal_binds": True}))
+    if db.engine.dialect.name == 'sqlite':
+        return ' | '.join(row[-1] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}')))
+    rows = db.session.execute(db.text(f'EXPLAIN {sql}')).mappings().all()
+    return ' | '.join(f"{row['type']}:{row['key']}" for row in rows)
+
+
+def get(client, token, url):
+    with contextlib.redirect_stdout(io.StringIO()):  # the view is wrapped in memory_profiler's report
+        response = client.get(url, headers={'Authorization': token})
+        return response, response.get_data()
+
+
+def timed(client, token, url, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        response, body = get(client, token, url)
+    return (time.perf_counter() - start) / repeat * 1000, response, body
+
+
+def run(customer, repeat):
+    token = jwt.encode({'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1), 'sub': customer},
+                       SECRET_KEY, algorithm='HS256')
+    client = app.test_client()
+
+    # Walk to a page deep in the history so its cursor can be timed too.
+    cursor, pages = None, 0
+    while True:
+        response, _ = get(client, token, "/purchase_history?limit=10" + (f"&cursor={cursor}" if cursor else ""))
+        if 'X-Next-Cursor' not in response.headers:
+            break
+        cursor, pages = response.headers['X-Next-Cursor'], pages + 1
+
+    cases = [
+        ("first page", "limit=100"),
+        (f"page after {pages * 10} purchases", f"limit=10&cursor={cursor}" if cursor else "limit=10"),
+        ("one month", "from=2024-03-01&to=2024-04-01"),
+        ("whole history as NDJSON", "format=ndjson"),
+    ]
+    for label, args in cases:
+        ms, response, body = timed(client, token, f"/purchase_history?{args}", repeat)
+        rows = body.count(b'\n') if response.mimetype == 'application/x-ndjson' else len(response.get_json())
+        print(f"{label:>28}: {ms:8.2f} ms  ({rows} purchases)")
+        with app.test_request_context(f"/purchase_history?{args}"):
+            from flask import request
+            print(f"    plan: {query_plan(build_purchase_history(customer, request.args).limit(100))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--purchases", type=int, default=10000000)
+    parser.add_argument("--customers", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    sales.limiter.enabled = False
+    print(f"{seed(args.purchases, args.customers)} purchases")
+    with app.app_context():
+        run(username(0), args.repeat)
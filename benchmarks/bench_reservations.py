@@ -0,0 +1,70 @@
+"""
+Throughput benchmark of stock reservations: reserve then commit, from many threads.
+
+Every thread reserves one unit of the same good and commits the reservation, the way Sales
+does for each purchase. Reserving contends on the good's row; committing only touches the
+reservation's own row, so the commit rate should stay flat as threads are added.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_reservations --threads 8 --reservations 500
+
+The database is taken from ``SQLALCHEMY_DATABASE_URI`` like the service itself.
+"""
+import argparse
+import threading
+import time
+
+from inventory.app import app, db, Goods, reservation_manager
+
+NAME = "reservationbench"
+
+
+def setup(stock):
+    with app.app_context():
+        db.create_all()
+        good = Goods.query.filter_by(name=NAME).first()
+        if good is None:
+            good = Goods(NAME, "electronics", 1.0, "Benchmark good", stock)
+            db.session.add(good)
+        good.count_in_stock = stock
+        db.session.commit()
+
+
+def run(threads, reservations):
+    reserve_time, commit_time = [], []
+
+    def buyer():
+        with app.app_context():
+            for _ in range(reservations):
+                start = time.perf_counter()
+                reservation, _ = reservation_manager.reserve(NAME, 1, 60)
+                db.session.commit()
+                reserved = time.perf_counter()
+                reservation_manager.commit(reservation.id)
+                db.session.commit()
+                reserve_time.append(reserved - start)
+                commit_time.append(time.perf_counter() - reserved)
+
+    pool = [threading.Thread(target=buyer) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    total = threads * reservations
+    print(f"{threads:3d} threads: {total / elapsed:8.1f} purchases/s  "
+          f"reserve {sum(reserve_time) / total * 1000:6.2f} ms  commit {sum(commit_time) / total * 1000:6.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--reservations", type=int, default=500, help="reservations per thread")
+    args = parser.parse_args()
+
+    for threads in sorted({1, args.threads}):
+        setup(threads * args.reservations)
+        run(threads, args.reservations)
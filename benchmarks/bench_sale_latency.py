@@ -0,0 +1,92 @@
+"""
+Latency of ``make_sale`` against stubbed inventory and customers services.
+
+The services are replaced by stubs that answer after a fixed delay, so the numbers show
+how the sale's critical path adds up: a sale costs the lookup, the wallet hold, the stock
+update and the capture, one after another. A sale refused for insufficient funds stops at
+the hold and never calls the inventory service to take stock.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_sale_latency --sales 50 --inventory-delay 40 --customers-delay 60
+
+The database is taken from ``SQLALCHEMY_DATABASE_URI`` like the service itself.
+"""
+import argparse
+import contextlib
+import io
+import statistics
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import Sales.app as sales
+from Sales.app import app, db, SECRET_KEY
+
+import jwt
+
+GOOD = {"name": "salebench", "category": "electronics", "price_per_item": 1.0,
+        "description": "Benchmark good", "count_in_stock": 10 ** 9}
+
+
+def stubs(inventory_delay, customers_delay, hold_status, stock_calls):
+    def respond(url, status, body=None):
+        time.sleep(inventory_delay if url.startswith(app.config['INVENTORY_URL']) else customers_delay)
+        return MagicMock(status_code=status, json=MagicMock(return_value=body))
+
+    def get(session, url, *args, **kwargs):
+        return respond(url, 200, GOOD)
+
+    def post(session, url, *args, **kwargs):
+        if url.endswith("/wallet/holds"):
+            return respond(url, hold_status, {"hold_id": 1})
+        if "/decrease_stock/" in url:
+            stock_calls.append(url)
+        return respond(url, 200, {})
+
+    return get, post
+
+
+def run(label, hold_status, sales_count, threads, token, inventory_delay, customers_delay):
+    stock_calls = []
+    get, post = stubs(inventory_delay, customers_delay, hold_status, stock_calls)
+    latencies = []
+
+    def customer():
+        client = app.test_client()
+        for _ in range(sales_count):
+            start = time.perf_counter()
+            response = client.post("/sale", json={"name": GOOD["name"]}, headers={"Authorization": token})
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == (200 if hold_status == 201 else 400), response.get_json()
+
+    pool = [threading.Thread(target=customer) for _ in range(threads)]
+    start = time.perf_counter()
+    with patch.object(sales.requests.Session, "get", get), patch.object(sales.requests.Session, "post", post), \
+            contextlib.redirect_stdout(io.StringIO()):  # make_sale is wrapped in memory_profiler's report
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+    elapsed = time.perf_counter() - start
+
+    ms = sorted(latency * 1000 for latency in latencies)
+    print(f"{label:>9}: p50 {statistics.median(ms):7.1f} ms  p95 {ms[int(len(ms) * 0.95) - 1]:7.1f} ms  "
+          f"{len(ms) / elapsed:6.1f} sales/s  {len(stock_calls)} stock updates")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sales", type=int, default=50, help="sales per client thread")
+    parser.add_argument("--threads", type=int, default=1, help="concurrent clients")
+    parser.add_argument("--inventory-delay", type=float, default=40, help="ms per inventory call")
+    parser.add_argument("--customers-delay", type=float, default=60, help="ms per customers call")
+    args = parser.parse_args()
+
+    sales.limiter.enabled = False
+    with app.app_context():
+        db.create_all()
+    token = jwt.encode({"sub": "salebench"}, SECRET_KEY, algorithm="HS256")
+    delays = args.inventory_delay / 1000, args.customers_delay / 1000
+    run("completed", 201, args.sales, args.threads, token, *delays)
+    run("refused", 400, args.sales, args.threads, token, *delays)
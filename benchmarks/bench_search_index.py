@@ -0,0 +1,74 @@
+"""
+Build time, memory footprint and query latency of the in-memory goods search index.
+
+The index is loaded with ``--goods`` synthetic products (1M by default): names made of a
+colour, an adjective, a product noun and a model number, and descriptions of a dozen
+words drawn from a few thousand. Memory is measured with ``tracemalloc`` while loading.
+Query latency covers :meth:`GoodsSearchIndex.search` only; the endpoint adds one
+primary-key lookup for the returned page.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_search_index --goods 1000000 --repeat 200
+"""
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+
+from inventory.app import GoodsSearchIndex
+
+COLOURS = ["red", "blue", "green", "black", "white", "silver", "gold", "pink", "grey", "orange"]
+ADJECTIVES = ["classic", "premium", "compact", "wireless", "portable", "smart", "ultra", "eco", "pro", "mini",
+              "deluxe", "rugged", "slim", "vintage", "organic", "sport", "digital", "heavy", "soft", "quick"]
+NOUNS = ["phone", "laptop", "charger", "jacket", "shirt", "watch", "headphones", "speaker", "camera", "backpack",
+         "wallet", "belt", "shoes", "apple", "banana", "coffee", "tea", "chocolate", "cable", "keyboard",
+         "mouse", "monitor", "tablet", "lamp", "bottle", "scarf", "hat", "sunglasses", "bracelet", "ring"]
+
+QUERIES = ["phone", "red phone", "wireless head", "premium black jacket", "x1234", "organic coff",
+           "silver smart watch pro", "ke", "key"]
+
+
+def generate(goods, seed=42):
+    rng = random.Random(seed)
+    words = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))) for _ in range(5000)]
+    for good_id in range(1, goods + 1):
+        name = f"{rng.choice(COLOURS)} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} x{rng.randint(1, 99999)}"
+        description = " ".join(rng.choice(words) for _ in range(12))
+        yield good_id, name, description
+
+
+def run(goods, repeat):
+    index = GoodsSearchIndex()
+    rows = list(generate(goods))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index.load(rows)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    stats = index.stats()
+    print(f"{goods} goods indexed in {elapsed:.1f} s: {memory / 2**20:.0f} MiB, "
+          f"{memory / goods:.0f} bytes/good, {stats['tokens']} tokens, {stats['postings']} postings")
+
+    for query in QUERIES:
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            hits = index.search(query, 20)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        print(f"{query!r:>26}: p50 {statistics.median(latencies):7.3f} ms  "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:7.3f} ms  {len(hits)} hits")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--goods", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    run(args.goods, args.repeat)
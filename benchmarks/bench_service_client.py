@@ -0,0 +1,84 @@
+"""
+Requests per second from Sales to a local stub inventory, with and without connection pooling.
+
+The stub is a threaded HTTP/1.1 server on localhost answering ``GET /goods/<name>``. The
+unpooled run calls ``requests.get`` through the circuit breaker, opening a TCP connection
+per call as Sales used to; the pooled run goes through a :class:`ServiceClient`, which
+reuses keep-alive connections. The stub counts the connections it accepted.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_service_client --threads 8 --requests 500
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from pybreaker import CircuitBreaker
+
+from Sales.app import ServiceClient
+
+GOOD = json.dumps({"name": "Apple", "category": "food", "price_per_item": 1.0,
+                   "description": "", "count_in_stock": 10}).encode()
+
+
+class StubInventory(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections open between requests
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StubInventory.lock:
+            StubInventory.connections += 1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(GOOD)))
+        self.end_headers()
+        self.wfile.write(GOOD)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(label, get, threads, count):
+    StubInventory.connections = 0
+
+    def worker():
+        for _ in range(count):
+            assert get("/goods/Apple").status_code == 200
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print(f"{label:>8}: {threads * count / elapsed:8.1f} requests/s  "
+          f"{StubInventory.connections} connections for {threads * count} requests")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500, help="requests per thread")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubInventory)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    breaker = CircuitBreaker(fail_max=5, reset_timeout=60)
+    run("unpooled", lambda path: breaker.call(requests.get, f"{base_url}{path}"), args.threads, args.requests)
+    client = ServiceClient(base_url, CircuitBreaker(fail_max=5, reset_timeout=60), pool_size=args.threads)
+    run("pooled", client.get, args.threads, args.requests)
+    print(f"  client: {client.stats()}")
+    server.shutdown()
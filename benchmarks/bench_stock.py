@@ -0,0 +1,90 @@
+"""
+Contention benchmark of ``decrease_stock`` with the conditional UPDATE and the old read-modify-write.
+
+Many threads try to buy the same good at once, like a flash sale. The stock engine
+should sell exactly the initial stock and never drive it below zero; the legacy path
+(load the row, check in Python, subtract, commit) is kept here for comparison and can
+oversell when reads interleave.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_stock --threads 16 --stock 2000
+
+The database is taken from ``SQLALCHEMY_DATABASE_URI`` like the service itself.
+"""
+import argparse
+import threading
+import time
+
+from inventory.app import app, db, Goods, stock_engine, OutOfStockError
+
+NAME = "stockbench"
+
+
+def reset(stock):
+    with app.app_context():
+        db.create_all()
+        good = Goods.query.filter_by(name=NAME).first()
+        if good is None:
+            good = Goods(NAME, "electronics", 1.0, "Benchmark good", stock)
+            db.session.add(good)
+        good.count_in_stock = stock
+        db.session.commit()
+
+
+def legacy_decrease():
+    good = Goods.query.filter_by(name=NAME).first()
+    if good.count_in_stock <= 0:
+        raise OutOfStockError(NAME)
+    good.count_in_stock -= 1
+    db.session.commit()
+
+
+def engine_decrease():
+    stock_engine.decrease(NAME)
+    db.session.commit()
+
+
+def run(label, decrease, threads, stock):
+    reset(stock)
+    sold = []
+    errors = []
+
+    def buyer():
+        with app.app_context():
+            while True:
+                try:
+                    decrease()
+                    sold.append(1)
+                except OutOfStockError:
+                    db.session.rollback()
+                    return
+                except Exception as e:  # lock timeouts and the like; counted, not retried
+                    db.session.rollback()
+                    errors.append(e)
+                    if len(errors) > stock:
+                        return
+
+    pool = [threading.Thread(target=buyer) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        left = Goods.query.filter_by(name=NAME).first().count_in_stock
+    oversold = len(sold) - (stock - left)
+    print(f"{label:>7}: {len(sold) / elapsed:8.1f} sales/s  sold {len(sold)}/{stock}  "
+          f"left {left}  oversold {oversold}  errors {len(errors)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--stock", type=int, default=2000)
+    args = parser.parse_args()
+
+    run("legacy", legacy_decrease, args.threads, args.stock)
+    run("engine", engine_decrease, args.threads, args.stock)
@@ -0,0 +1,85 @@
+"""
+Decrement throughput of one hot good kept in a single row and split across stock shards.
+
+Every writer buys the same good in a loop, like a flash sale on one SKU. With a single row
+each decrement waits for the row lock held by the previous buyer's transaction; with shards
+the buyers spread over ``--shards`` rows. Both modes must sell exactly the initial stock.
+The run is repeated for each writer count in ``--threads``.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_stock_shards --threads 16 32 64 --shards 16 --stock 20000
+
+The database is taken from ``SQLALCHEMY_DATABASE_URI`` like the service itself. SQLite
+serializes all writers, so run it against MySQL to see the effect of sharding.
+"""
+import argparse
+import threading
+import time
+
+from inventory.app import app, db, Goods, stock_engine, OutOfStockError
+
+NAME = "shardbench"
+
+
+def reset(stock, shards):
+    with app.app_context():
+        db.create_all()
+        good = Goods.query.filter_by(name=NAME).first()
+        if good is None:
+            good = Goods(NAME, "electronics", 1.0, "Benchmark good", stock)
+            db.session.add(good)
+            db.session.commit()
+        stock_engine.set_shards(NAME, 0)
+        good.count_in_stock = stock
+        db.session.commit()
+        stock_engine.set_shards(NAME, shards)
+        db.session.commit()
+
+
+def run(threads, shards, stock):
+    reset(stock, shards)
+    sold = []
+    errors = []
+
+    def buyer():
+        with app.app_context():
+            while True:
+                try:
+                    stock_engine.decrease(NAME)
+                    db.session.commit()
+                    sold.append(1)
+                except OutOfStockError:
+                    db.session.rollback()
+                    return
+                except Exception as e:  # lock timeouts and the like; counted, not retried
+                    db.session.rollback()
+                    errors.append(e)
+                    if len(errors) > stock:
+                        return
+
+    pool = [threading.Thread(target=buyer) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        left = stock_engine.total(Goods.query.filter_by(name=NAME).first())
+    label = f"{shards} shards" if shards else "single row"
+    print(f"{threads:3d} writers, {label:>10}: {len(sold) / elapsed:8.1f} sales/s  "
+          f"sold {len(sold)}/{stock}  left {left}  oversold {len(sold) - (stock - left)}  errors {len(errors)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--stock", type=int, default=20000)
+    args = parser.parse_args()
+
+    for threads in args.threads:
+        run(threads, 0, args.stock)
+        run(threads, args.shards, args.stock)
@@ -0,0 +1,110 @@
+"""
+Concurrency benchmark for the customers wallet engine.
+
+Many threads deduct from one hot account at the same time. The account starts with
+enough money for exactly half of the attempts, so a correct engine ends at a balance
+of zero with every other attempt rejected. The legacy read-modify-write path
+(SELECT, check in Python, UPDATE) is run the same way for comparison.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_wallet --threads 16 --ops 200
+
+The database is taken from ``SQLALCHEMY_DATABASE_URI`` like the service itself.
+"""
+import argparse
+import threading
+import time
+
+from customers.app import app, db, Customer, wallet_engine, InsufficientFundsError
+
+HOT_USERNAME = "hotwallet"
+AMOUNT = 1.0
+
+
+def reset_account(balance):
+    with app.app_context():
+        db.create_all()
+        Customer.query.filter_by(username=HOT_USERNAME).delete()
+        customer = Customer("Hot", "Wallet", HOT_USERNAME, "password",
+                            30, "1 Benchmark Street", "other", "single")
+        customer.wallet = balance
+        db.session.add(customer)
+        db.session.commit()
+
+
+def read_balance():
+    with app.app_context():
+        return wallet_engine.balance(Customer.query.filter_by(username=HOT_USERNAME).first())
+
+
+def engine_deduct():
+    try:
+        wallet_engine.deduct(HOT_USERNAME, AMOUNT)
+        db.session.commit()
+        return True
+    except InsufficientFundsError:
+        db.session.rollback()
+        return False
+
+
+def legacy_deduct():
+    customer = Customer.query.filter_by(username=HOT_USERNAME).first()
+    if customer.wallet < AMOUNT:
+        db.session.rollback()
+        return False
+    customer.wallet -= AMOUNT
+    db.session.commit()
+    return True
+
+
+def run(deduct, threads, ops):
+    attempts = threads * ops
+    initial = attempts * AMOUNT / 2
+    reset_account(initial)
+    counts = {"ok": 0, "rejected": 0, "errors": 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        ok = rejected = errors = 0
+        with app.app_context():
+            barrier.wait()
+            for _ in range(ops):
+                try:
+                    if deduct():
+                        ok += 1
+                    else:
+                        rejected += 1
+                except Exception:
+                    db.session.rollback()
+                    errors += 1
+        with lock:
+            counts["ok"] += ok
+            counts["rejected"] += rejected
+            counts["errors"] += errors
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    final = read_balance()
+    expected = initial - counts["ok"] * AMOUNT
+    print(f"{deduct.__name__:>14}: {attempts / elapsed:9.1f} ops/s  "
+          f"ok={counts['ok']} rejected={counts['rejected']} errors={counts['errors']}  "
+          f"final={final:.2f} expected={expected:.2f} "
+          f"{'OK' if abs(final - expected) < 1e-6 and final >= 0 else 'LOST UPDATES'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=200, help="deductions per thread")
+    args = parser.parse_args()
+
+    run(engine_deduct, args.threads, args.ops)
+    run(legacy_deduct, args.threads, args.ops)
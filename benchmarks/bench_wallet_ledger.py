@@ -0,0 +1,69 @@
+"""
+Write-throughput benchmark: append-only wallet ledger against in-place row updates.
+
+Every thread charges the same hot account, then deducts from it. The row engine
+updates ``Customer.wallet`` in place, so every write queues on the customer row lock.
+The ledger engine inserts one entry per charge and only locks the row for deductions.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_wallet_ledger --threads 16 --ops 200
+
+The database is taken from ``SQLALCHEMY_DATABASE_URI`` like the service itself.
+"""
+import argparse
+import threading
+import time
+
+from customers.app import app, db, Customer, WalletEngine, LedgerWalletEngine
+
+HOT_USERNAME = "hotledger"
+
+
+def reset_account():
+    with app.app_context():
+        db.create_all()
+        Customer.query.filter_by(username=HOT_USERNAME).delete()
+        db.session.add(Customer("Hot", "Ledger", HOT_USERNAME, "password",
+                                30, "1 Benchmark Street", "other", "single"))
+        db.session.commit()
+
+
+def run(engine, operation, threads, ops):
+    errors = []
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        with app.app_context():
+            barrier.wait()
+            for _ in range(ops):
+                try:
+                    getattr(engine, operation)(HOT_USERNAME, 1.0)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(e)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    print(f"{type(engine).__name__:>18} {operation:>6}: {threads * ops / elapsed:9.1f} writes/s  errors={len(errors)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=200, help="writes per thread and operation")
+    args = parser.parse_args()
+
+    for engine in (WalletEngine(), LedgerWalletEngine()):
+        reset_account()
+        run(engine, "charge", args.threads, args.ops)
+        run(engine, "deduct", args.threads, args.ops)
+        with app.app_context():
+            customer = Customer.query.filter_by(username=HOT_USERNAME).first()
+            print(f"{'':>18} final balance: {engine.balance(customer):.2f} (expected 0.00)")
@@ -0,0 +1,371 @@
+"""
+Building blocks shared by the services: the JWT cache behind ``token_required``, the pooled
+HTTP client for calls to other services and the catalog replica fed by the inventory change feed.
+
+The services import this package from the repository root; each service image copies it next
+to its ``app.py``.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+import requests
+from pybreaker import CircuitBreakerError
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCache:
+    """
+    A bounded LRU cache of verified JWTs.
+
+    A token is only cached after ``jwt.decode`` has checked its signature, and each entry
+    expires at the token's own ``exp`` claim, so a cache hit is exactly as valid as a fresh
+    decode while skipping the HMAC check. A ``maxsize`` of 0 disables the cache.
+
+    :param maxsize: The maximum number of tokens kept.
+    :type maxsize: int
+    :param secret_key: The key the tokens are signed with.
+    :type secret_key: str
+    """
+
+    def __init__(self, maxsize, secret_key):
+        """Constructor method
+        """
+        self.maxsize = maxsize
+        self.secret_key = secret_key
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def decode(self, token):
+        """
+        Returns the claims of a token, verifying it only if it is not cached.
+
+        :param token: The encoded JWT.
+        :type token: str
+        :return: The decoded claims.
+        :rtype: dict
+        :raises jwt.InvalidTokenError: If the token is invalid or expired.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        data = jwt.decode(token, self.secret_key, algorithms=["HS256"])
+
+        if self.maxsize and 'exp' in data:
+            with self._lock:
+                self._entries[token] = (data, data['exp'])
+                self._entries.move_to_end(token)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return data
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of the cache.
+
+        :return: The cache size, bound, hits, misses and hit ratio.
+        :rtype: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0
+            }
+
+
+class ServiceClient:
+    """
+    HTTP client for one downstream service.
+
+    Calls go through one ``requests.Session`` whose connection pool keeps up to ``pool_size``
+    keep-alive connections to the service, instead of opening a new TCP connection per call.
+    Every call gets default connect and read timeouts, and is guarded by the service's
+    circuit breaker when one is given. The breaker is entered with ``calling()``, which only
+    holds the breaker's lock to check its state, so concurrent calls to the service are not
+    serialized behind each other.
+
+    :param base_url: The URL of the service.
+    :type base_url: str
+    :param breaker: The circuit breaker guarding the service, or ``None``.
+    :type breaker: pybreaker.CircuitBreaker
+    :param pool_size: Keep-alive connections kept open to the service.
+    :type pool_size: int
+    :param connect_timeout: Seconds to wait for a connection.
+    :type connect_timeout: float
+    :param read_timeout: Seconds to wait for the response.
+    :type read_timeout: float
+    """
+
+    def __init__(self, base_url, breaker=None, pool_size=10, connect_timeout=3.05, read_timeout=10):
+        """Constructor method
+        """
+        self.base_url = base_url.rstrip('/')
+        self.breaker = breaker
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def get(self, path, **kwargs):
+        """
+        Sends a GET request to ``path`` on the service.
+
+        :param path: The path, starting with a slash.
+        :type path: str
+        :param kwargs: Passed on to :meth:`requests.Session.get`.
+        :return: The response.
+        :rtype: requests.Response
+        :raises CircuitBreakerError: If the breaker is open.
+        """
+        return self._send(self.session.get, path, kwargs)
+
+    def post(self, path, **kwargs):
+        """
+        Sends a POST request to ``path`` on the service.
+
+        :param path: The path, starting with a slash.
+        :type path: str
+        :param kwargs: Passed on to :meth:`requests.Session.post`.
+        :return: The response.
+        :rtype: requests.Response
+        :raises CircuitBreakerError: If the breaker is open.
+        """
+        return self._send(self.session.post, path, kwargs)
+
+    def _send(self, send, path, kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        url = f'{self.base_url}{path}'
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if self.breaker is None:
+                return send(url, **kwargs)
+            with self.breaker.calling():
+                return send(url, **kwargs)
+        except CircuitBreakerError:
+            with self._lock:
+                self.rejected += 1
+            raise
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def stats(self):
+        """
+        Returns the utilization of the connection pool and the call counters.
+
+        ``connections_opened`` counts the TCP connections made so far; with keep-alive it
+        stays close to the peak number of calls in flight. ``rejected`` counts the calls that
+        ended in ``CircuitBreakerError``, including the failed call that opened the breaker.
+
+        :rtype: dict
+        """
+        pools = self._adapter.poolmanager.pools
+        connections = sum(pools[key].num_connections for key in pools.keys())
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "utilization": self.in_flight / self.pool_size,
+                "connections_opened": connections,
+                "calls": self.calls,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "breaker": self.breaker.current_state if self.breaker is not None else None
+            }
+
+
+class CatalogReplica:
+    """
+    An in-memory copy of the inventory catalog, kept current from the inventory change feed.
+
+    The replica loads ``/goods/snapshot`` once and then long-polls ``/goods/changes`` from the
+    snapshot's sequence number, applying each change as it arrives, so reads are dictionary
+    lookups instead of HTTP calls. It only answers while it is fresh: before the first
+    snapshot, and whenever the last successful poll is older than ``max_staleness`` seconds,
+    :attr:`ready` is false and callers ask the inventory service instead.
+
+    :param client: The client of the inventory service. Syncing runs in the background with
+        its own backoff, so the client should not share the inventory circuit breaker.
+    :type client: ServiceClient
+    :param poll_wait: Seconds each long-poll may wait for a change.
+    :type poll_wait: int
+    :param max_staleness: Seconds after the last successful poll during which the replica is used.
+    :type max_staleness: int
+    """
+
+    def __init__(self, client, poll_wait=25, max_staleness=60):
+        """Constructor method
+        """
+        self.client = client
+        self.poll_wait = poll_wait
+        self.max_staleness = max_staleness
+        self.seq = None
+        self.last_sync = None
+        self.snapshots = 0
+        self.changes_applied = 0
+        self._goods = {}
+        self._names = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        """
+        Whether the replica is recent enough to answer reads.
+
+        :rtype: bool
+        """
+        return self.last_sync is not None and time.monotonic() - self.last_sync < self.max_staleness
+
+    def get(self, name):
+        """
+        Returns a good by name. The returned dict must not be modified.
+
+        :param name: The name of the good.
+        :type name: str
+        :return: The good, or ``None`` if there is no good with that name.
+        :rtype: dict
+        """
+        with self._lock:
+            return self._goods.get(name)
+
+    def all(self):
+        """
+        Returns every good, in ID order like ``GET /goods``.
+
+        :rtype: list[dict]
+        """
+        with self._lock:
+            goods = list(self._goods.values())
+        return sorted(goods, key=lambda good: good['id'])
+
+    def load_snapshot(self):
+        """
+        Replaces the contents with a fresh snapshot of the catalog.
+        """
+        response = self.client.get('/goods/snapshot', timeout=30)
+        response.raise_for_status()
+        snapshot = response.json()
+        goods = {good['name']: good for good in snapshot['goods']}
+        with self._lock:
+            self._goods = goods
+            self._names = {good['id']: good['name'] for good in goods.values()}
+            self.seq = snapshot['seq']
+            self.snapshots += 1
+        self.last_sync = time.monotonic()
+
+    def poll(self):
+        """
+        Waits for the next changes and applies them, re-snapshotting if the feed was pruned past us.
+        """
+        response = self.client.get('/goods/changes',
+                                   params={'since': self.seq, 'wait': self.poll_wait},
+                                   timeout=self.poll_wait + 10)
+        if response.status_code == 410:
+            self.load_snapshot()
+            return
+        response.raise_for_status()
+        feed = response.json()
+        for change in feed['changes']:
+            self.apply(change)
+        self.seq = feed['last_seq']
+        self.last_sync = time.monotonic()
+
+    def apply(self, change):
+        """
+        Applies one change of the inventory change feed.
+
+        :param change: The change, as served by ``/goods/changes``.
+        :type change: dict
+        """
+        with self._lock:
+            if change['kind'] == 'stock':
+                good = self._goods.get(change['name'])
+                if good is not None:
+                    self._goods[change['name']] = dict(good, count_in_stock=change['good']['count_in_stock'])
+            elif change['kind'] == 'delete':
+                self._goods.pop(self._names.pop(change['good_id'], change['name']), None)
+            else:
+                good = change['good']
+                previous_name = self._names.get(good['id'])
+                if previous_name is not None and previous_name != good['name']:
+                    self._goods.pop(previous_name, None)
+                self._names[good['id']] = good['name']
+                self._goods[good['name']] = good
+            self.changes_applied += 1
+
+    def start(self):
+        """
+        Starts a daemon thread that snapshots the catalog and then follows the change feed,
+        backing off while the inventory service is unreachable.
+
+        :return: The thread. Set its ``stop`` event to end it.
+        :rtype: threading.Thread
+        """
+        stop = threading.Event()
+
+        def run():
+            backoff = 1
+            while not stop.is_set():
+                try:
+                    if self.seq is None:
+                        self.load_snapshot()
+                    else:
+                        self.poll()
+                    backoff = 1
+                except Exception as e:
+                    logger.warning(f"Catalog replica sync failed, retrying in {backoff}s: {e}")
+                    stop.wait(backoff)
+                    backoff = min(backoff * 2, 30)
+
+        thread = threading.Thread(target=run, name="catalog-replica", daemon=True)
+        thread.stop = stop
+        thread.start()
+        return thread
+
+    def stats(self):
+        """
+        Returns the state of the replica.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "goods": len(self._goods),
+                "seq": self.seq,
+                "seconds_since_sync": time.monotonic() - self.last_sync if self.last_sync is not None else None,
+                "snapshots": self.snapshots,
+                "changes_applied": self.changes_applied
+            }
@@ -0,0 +1,104 @@
+import datetime
+import jwt
+import pytest
+from unittest.mock import patch, MagicMock
+from pybreaker import CircuitBreaker, CircuitBreakerError
+
+from ..common.clients import TokenCache, ServiceClient, CatalogReplica
+
+SECRET_KEY = 'test-secret'
+
+def create_token(username):
+    payload = {
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=2),
+        'iat': datetime.datetime.utcnow(),
+        'sub': username
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+
+def test_token_cache():
+    cache = TokenCache(2, SECRET_KEY)
+    first, second, third = create_token('first'), create_token('second'), create_token('third')
+
+    assert cache.decode(first)['sub'] == 'first'
+    assert cache.decode(first)['sub'] == 'first'
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+    cache.decode(second)
+    cache.decode(third)
+    assert cache.stats()['size'] == 2
+    cache.decode(first)  # evicted as least recently used
+    assert cache.stats()['misses'] == 4
+
+    with pytest.raises(jwt.InvalidTokenError):
+        cache.decode(first[:-2] + 'xx')
+    with pytest.raises(jwt.InvalidTokenError):
+        TokenCache(2, 'other-secret').decode(first)
+
+    disabled = TokenCache(0, SECRET_KEY)
+    disabled.decode(first)
+    disabled.decode(first)
+    assert disabled.stats() == {'size': 0, 'maxsize': 0, 'hits': 0, 'misses': 2, 'hit_ratio': 0.0}
+
+def test_service_client():
+    breaker = CircuitBreaker(fail_max=2, reset_timeout=60)
+    service = ServiceClient('http://inventory:5001/', breaker, pool_size=4, connect_timeout=1, read_timeout=2)
+    with patch('requests.Session.get') as mock_get:
+        mock_get.return_value = MagicMock(status_code=200)
+        assert service.get('/goods/Apple').status_code == 200
+        mock_get.assert_called_once_with('http://inventory:5001/goods/Apple', timeout=(1, 2))
+        service.get('/goods/snapshot', timeout=30)
+        assert mock_get.call_args.kwargs['timeout'] == 30
+
+        mock_get.side_effect = ConnectionError('refused')
+        with pytest.raises(ConnectionError):
+            service.get('/goods')
+        with pytest.raises(CircuitBreakerError):
+            service.get('/goods')  # The second failure opens the breaker
+        with pytest.raises(CircuitBreakerError):
+            service.get('/goods')
+        assert mock_get.call_count == 4
+
+    stats = service.stats()
+    assert stats['calls'] == 5 and stats['failures'] == 1 and stats['rejected'] == 2
+    assert stats['in_flight'] == 0 and stats['peak_in_flight'] == 1 and stats['pool_size'] == 4
+    assert stats['breaker'] == 'open'
+
+def test_catalog_replica():
+    replica = CatalogReplica(ServiceClient('http://inventory:5001', pool_size=1), poll_wait=0)
+    snapshot = {'seq': 4, 'goods': [
+        {'id': 1, 'name': 'Apple', 'category': 'food', 'price_per_item': 1.0, 'description': '', 'count_in_stock': 10},
+        {'id': 2, 'name': 'Laptop', 'category': 'electronics', 'price_per_item': 1000.0, 'description': '', 'count_in_stock': 2},
+    ]}
+    feed = {'last_seq': 6, 'changes': [
+        {'seq': 5, 'kind': 'stock', 'good_id': None, 'name': 'Apple', 'good': {'count_in_stock': 0}},
+        {'seq': 6, 'kind': 'update', 'good_id': 2, 'name': 'Notebook',
+         'good': dict(snapshot['goods'][1], name='Notebook')},
+    ]}
+
+    def side_effect_get(url, *args, **kwargs):
+        response = MagicMock()
+        response.status_code = 200
+        if url == 'http://inventory:5001/goods/snapshot':
+            response.json.return_value = snapshot
+        elif url == 'http://inventory:5001/goods/changes':
+            assert kwargs['params']['since'] == 4
+            response.json.return_value = feed
+        else:
+            raise ValueError('Unmocked url in get: ' + url)
+        return response
+
+    with patch('requests.Session.get') as mock_get:
+        mock_get.side_effect = side_effect_get
+        assert not replica.ready
+        replica.load_snapshot()
+        replica.poll()
+    assert replica.ready and replica.seq == 6
+    assert replica.get('Apple')['count_in_stock'] == 0
+    assert replica.get('Laptop') is None
+    assert [good['name'] for good in replica.all()] == ['Apple', 'Notebook']
+
+    replica.apply({'seq': 7, 'kind': 'delete', 'good_id': 2, 'name': 'Notebook', 'good': None})
+    assert replica.get('Notebook') is None
+    assert replica.stats()['changes_applied'] == 3
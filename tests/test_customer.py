@@ -1,10 +1,16 @@
 from flask import json
-from ..customers.app import app, db
+from ..customers import app as customers_app
+from ..customers.app import app, db, wallet_engine, LedgerWalletEngine, WalletEngine, CustomerNotFoundError, InsufficientFundsError, WalletHold, sweep_expired_holds, Customer, compact_wallet_ledger, profile_cache, ProfileCache, DatabaseInvalidationBus, build_customer_search, username_index, password_hasher, normalize_hash_method, migrate_customer_password_column, PasswordHasher
+from werkzeug.datastructures import MultiDict
+from werkzeug.security import generate_password_hash
+import jwt
+import datetime
 import pytest
 
 @pytest.fixture
 def client(customer2):
     app.config['TESTING'] = True
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'  # Keep hashing cheap in tests
     with app.test_client() as client:
         with app.app_context():
             db.drop_all()
@@ -16,6 +22,10 @@ def client(customer2):
         )
         yield client
 
+@pytest.fixture
+def ledger_engine(monkeypatch):
+    monkeypatch.setattr(customers_app, 'wallet_engine', LedgerWalletEngine())
+
 @pytest.fixture
 def customer1():
     user = {
@@ -57,7 +67,7 @@ def test_create_customer(client, customer1, customer2):
     assert data['first_name'] == 'Walter'
     assert data['last_name'] == 'White'
     assert data['username'] == 'walt12'
-    assert data['password'] == '123456'
+    assert 'password' not in data
     assert data['age'] == 50
     assert data['address'] == '308 Negra Arroyo Lane, Albuquerque, NM'
     assert data['gender'] == 'male'
@@ -84,7 +94,7 @@ def test_get_customer_by_username(client, customer2):
     assert data['first_name'] == 'Gale'
     assert data['last_name'] == 'Boetticer'
     assert data['username'] == 'gale12'
-    assert data['password'] == '123456'  
+    assert 'password' not in data
     assert data['age'] == 40
     assert data['address'] == '6353 Juan Tabo Blvd NE, Apt 6, Albuquerque, New Mexico 87111'
     assert data['gender'] == 'male'
@@ -168,7 +178,7 @@ def test_update_customer_information(client, customer2):
     assert data['first_name'] == 'Gale'
     assert data['last_name'] == 'Boetticer'
     assert data['username'] == 'gale12'
-    assert data['password'] == '123456'  
+    assert 'password' not in data
     assert data['gender'] == 'male'
     assert data['marital_status'] == 'single'
     assert res2.json['age'] == updated_data['age']  
@@ -197,9 +207,38 @@ def test_get_all_customers(client, customer1, customer2):
 
     assert c1['address'] == "6353 Juan Tabo Blvd NE, Apt 6, Albuquerque, New Mexico 87111"
     assert c2['address'] == "308 Negra Arroyo Lane, Albuquerque, NM"
+    assert 'password' not in c1
 
     assert len(response.json) == 2  
 
+def test_get_all_customers_pagination(client, customer1):
+    for i in range(4):
+        client.post(
+            '/create_customer',
+            data=json.dumps(dict(customer1, username=f'walt{i}xx')),
+            content_type='application/json',
+        )
+
+    response = client.get('/get_all_customers?limit=2')
+    assert [c['username'] for c in response.json] == ['gale12', 'walt0xx']
+    after_id = response.headers['X-Next-After-Id']
+
+    response = client.get(f'/get_all_customers?limit=2&after_id={after_id}')
+    assert [c['username'] for c in response.json] == ['walt1xx', 'walt2xx']
+
+    response = client.get(f'/get_all_customers?limit=2&after_id={response.headers["X-Next-After-Id"]}')
+    assert [c['username'] for c in response.json] == ['walt3xx']
+    assert 'X-Next-After-Id' not in response.headers
+
+    response = client.get(f'/get_all_customers?format=ndjson&after_id={after_id}')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [c['username'] for c in lines] == ['walt1xx', 'walt2xx', 'walt3xx']
+    assert all('password' not in c for c in lines)
+
+    for query in ('after_id=abc', 'after_id=', 'limit=abc', 'limit=0', 'format=ndjson&after_id=abc'):
+        assert client.get(f'/get_all_customers?{query}').status_code == 400
+
 def test_charge_wallet(client, customer2):
     username = customer2['username']
     password = customer2['password']
@@ -263,4 +302,409 @@ def test_deduct_wallet(client, customer2):
         data=json.dumps({'amount': -100}),
         content_type='application/json',
     )
-    assert res.status_code == 400
\ No newline at end of file
+    assert res.status_code == 400
+
+def test_wallet_engine(client, customer2):
+    with app.app_context():
+        assert wallet_engine.charge(customer2['username'], 10) == 10
+        assert wallet_engine.deduct(customer2['username'], 4) == 6
+        db.session.commit()
+
+        with pytest.raises(InsufficientFundsError):
+            wallet_engine.deduct(customer2['username'], 7)
+        db.session.rollback()
+
+        with pytest.raises(CustomerNotFoundError):
+            wallet_engine.deduct('nobody', 1)
+        db.session.rollback()
+
+def test_wallet_holds(client, customer2):
+    res = client.post(
+        '/login',
+        data=json.dumps({"username": customer2['username'], "password": customer2['password']}),
+        content_type='application/json',
+    )
+    client.post('/charge_wallet', data=json.dumps({'amount': 50}), content_type='application/json')
+
+    res = client.post('/wallet/holds', data=json.dumps({'amount': 30}), content_type='application/json')
+    assert res.status_code == 201
+    assert res.json['new_balance'] == 20
+    captured_id = res.json['hold_id']
+
+    res = client.post('/wallet/holds', data=json.dumps({'amount': 30}), content_type='application/json')
+    assert res.status_code == 400
+
+    for ttl_seconds in (0, -5, 10 ** 12, '60', 1.5, True, None):
+        res = client.post('/wallet/holds', data=json.dumps({'amount': 5, 'ttl_seconds': ttl_seconds}),
+                          content_type='application/json')
+        assert res.status_code == 400
+    assert client.get(f"/get_customer_by_username/{customer2['username']}").json['wallet'] == 20
+
+    res = client.post(f'/wallet/holds/{captured_id}/capture')
+    assert res.status_code == 200
+    res = client.post(f'/wallet/holds/{captured_id}/void')
+    assert res.status_code == 409
+
+    res = client.post('/wallet/holds', data=json.dumps({'amount': 15}), content_type='application/json')
+    voided_id = res.json['hold_id']
+    res = client.post(f'/wallet/holds/{voided_id}/void')
+    assert res.status_code == 200
+    assert res.json['new_balance'] == 20
+
+    res = client.post('/wallet/holds/9999/capture')
+    assert res.status_code == 404
+
+def test_sweep_expired_holds(client, customer2):
+    client.post(
+        '/login',
+        data=json.dumps({"username": customer2['username'], "password": customer2['password']}),
+        content_type='application/json',
+    )
+    client.post('/charge_wallet', data=json.dumps({'amount': 10}), content_type='application/json')
+    res = client.post('/wallet/holds', data=json.dumps({'amount': 10}), content_type='application/json')
+    hold_id = res.json['hold_id']
+
+    with app.app_context():
+        hold = db.session.get(WalletHold, hold_id)
+        hold.expires_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        db.session.commit()
+        assert sweep_expired_holds() == 1
+        assert db.session.get(WalletHold, hold_id).status == 'expired'
+
+    res = client.post(f'/wallet/holds/{hold_id}/capture')
+    assert res.status_code == 409
+    res = client.post('/deduct_wallet', data=json.dumps({'amount': 10}), content_type='application/json')
+    assert res.json['new_balance'] == 0
+
+def test_sweep_expired_holds_of_deleted_customer(client, customer1, customer2):
+    client.post('/create_customer', data=json.dumps(customer1), content_type='application/json')
+    holds = {}
+    for customer in (customer2, customer1):
+        client.post(
+            '/login',
+            data=json.dumps({"username": customer['username'], "password": customer['password']}),
+            content_type='application/json',
+        )
+        client.post('/charge_wallet', data=json.dumps({'amount': 20}), content_type='application/json')
+        holds[customer['username']] = [
+            client.post('/wallet/holds', data=json.dumps({'amount': 10}), content_type='application/json').json['hold_id']
+            for _ in range(2)
+        ]
+
+    with app.app_context():
+        db.session.get(WalletHold, holds[customer2['username']][0]).expires_at = \
+            datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        # A hold left behind by a customer deleted before delete_customer voided their holds
+        orphan = WalletHold('ghost1', 10, datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+        db.session.add(orphan)
+        db.session.commit()
+        orphan_id = orphan.id
+
+    # customer1 is logged in
+    assert client.delete('/delete_customer').status_code == 200
+
+    with app.app_context():
+        assert {db.session.get(WalletHold, hold_id).status for hold_id in holds[customer1['username']]} == {'voided'}
+        assert sweep_expired_holds() == 2
+        assert db.session.get(WalletHold, orphan_id).status == 'expired'
+        assert wallet_engine.balance(Customer.query.filter_by(username=customer2['username']).first()) == 10
+
+def test_rename_moves_wallet_holds(client, customer2):
+    client.post(
+        '/login',
+        data=json.dumps({"username": customer2['username'], "password": customer2['password']}),
+        content_type='application/json',
+    )
+    client.post('/charge_wallet', data=json.dumps({'amount': 10}), content_type='application/json')
+    hold_id = client.post('/wallet/holds', data=json.dumps({'amount': 10}), content_type='application/json').json['hold_id']
+
+    res = client.put('/update_customer_information', data=json.dumps({'username': 'gale13'}),
+                     content_type='application/json')
+    assert res.status_code == 200
+    with app.app_context():
+        hold = db.session.get(WalletHold, hold_id)
+        assert hold.customer_username == 'gale13'
+        hold.expires_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        db.session.commit()
+        assert sweep_expired_holds() == 1
+        assert wallet_engine.balance(Customer.query.filter_by(username='gale13').first()) == 10
+
+@pytest.mark.parametrize('engine', [WalletEngine, LedgerWalletEngine])
+def test_listings_show_current_wallet(client, customer2, monkeypatch, engine):
+    monkeypatch.setattr(customers_app, 'wallet_engine', engine())
+    client.post(
+        '/login',
+        data=json.dumps({"username": customer2['username'], "password": customer2['password']}),
+        content_type='application/json',
+    )
+    client.post('/charge_wallet', data=json.dumps({'amount': 100}), content_type='application/json')
+    client.post('/deduct_wallet', data=json.dumps({'amount': 10}), content_type='application/json')
+
+    assert [c['wallet'] for c in client.get('/get_all_customers').json] == [90]
+    lines = client.get('/get_all_customers?format=ndjson').get_data(as_text=True).splitlines()
+    assert [json.loads(line)['wallet'] for line in lines] == [90]
+    assert [c['wallet'] for c in client.get('/customers/search').json['customers']] == [90]
+    if engine is WalletEngine:
+        assert [c['wallet'] for c in client.get('/customers/search?min_wallet=50').json['customers']] == [90]
+
+def test_wallet_history_needs_ledger_engine(client, customer2):
+    client.post(
+        '/login',
+        data=json.dumps({"username": customer2['username'], "password": customer2['password']}),
+        content_type='application/json',
+    )
+    res = client.get('/wallet/history')
+    assert res.status_code == 409
+    assert res.json['error'] == 'Wallet history needs WALLET_ENGINE=ledger'
+
+def test_wallet_history_and_compaction(client, customer2, ledger_engine):
+    client.post(
+        '/login',
+        data=json.dumps({"username": customer2['username'], "password": customer2['password']}),
+        content_type='application/json',
+    )
+    for amount in [10, 20, 30]:
+        client.post('/charge_wallet', data=json.dumps({'amount': amount}), content_type='application/json')
+    client.post('/deduct_wallet', data=json.dumps({'amount': 15}), content_type='application/json')
+
+    res = client.get('/wallet/history?limit=3')
+    assert res.status_code == 200
+    assert [e['amount'] for e in res.json['entries']] == [-15, 30, 20]
+    res = client.get(f"/wallet/history?limit=3&before_id={res.json['next_before_id']}")
+    assert [e['amount'] for e in res.json['entries']] == [10]
+    assert res.json['next_before_id'] is None
+    assert client.get('/wallet/history?before_id=abc').status_code == 400
+
+    app.config['WALLET_SNAPSHOT_EVERY'], app.config['WALLET_SETTLE_SECONDS'] = 1, 0
+    try:
+        with app.app_context():
+            assert compact_wallet_ledger() == 1
+            assert compact_wallet_ledger() == 0
+            assert Customer.query.filter_by(username=customer2['username']).first().wallet == 45
+    finally:
+        app.config['WALLET_SNAPSHOT_EVERY'], app.config['WALLET_SETTLE_SECONDS'] = 100, 5
+
+    res = client.post('/charge_wallet', data=json.dumps({'amount': 5}), content_type='application/json')
+    assert res.json['new_balance'] == 50
+    res = client.get(f"/get_customer_by_username/{customer2['username']}")
+    assert res.json['wallet'] == 50
+
+def test_bulk_import_customers(client, customer1, customer2):
+    bad_age = dict(customer1, username='young1', age=12)
+    other = dict(customer1, username='jesse12', first_name='Jesse')
+    app.config['BULK_IMPORT_BATCH_SIZE'] = 2
+    try:
+        res = client.post(
+            '/customers/bulk_import',
+            data=json.dumps([customer1, customer2, bad_age, other, customer1]),
+            content_type='application/json',
+        )
+        assert res.status_code == 200
+        assert res.json['inserted'] == 2
+        assert sorted(f['row'] for f in res.json['failed']) == [2, 3, 5]
+
+        lines = [json.dumps(dict(customer1, username=f'skyler{i}')) for i in range(3)]
+        lines.insert(1, '{not json')
+        res = client.post(
+            '/customers/bulk_import',
+            data='\n'.join(lines) + '\n',
+            content_type='application/x-ndjson',
+        )
+        assert res.status_code == 200
+        assert res.json['inserted'] == 3
+        assert [f['row'] for f in res.json['failed']] == [2]
+    finally:
+        app.config['BULK_IMPORT_BATCH_SIZE'] = 1000
+
+    res = client.get('/get_customer_by_username/skyler2')
+    assert res.status_code == 200
+    assert res.json['wallet'] == 0
+
+    res = client.post('/customers/bulk_import', data=json.dumps({'a': 1}), content_type='application/json')
+    assert res.status_code == 400
+
+def test_profile_cache(client, customer2):
+    client.post(
+        '/login',
+        data=json.dumps({"username": customer2['username'], "password": customer2['password']}),
+        content_type='application/json',
+    )
+    hits = profile_cache.stats()['hits']
+    assert client.get('/get_customer_by_username/gale12').json['wallet'] == 0
+    assert client.get('/get_customer_by_username/gale12').json['wallet'] == 0
+    assert profile_cache.stats()['hits'] == hits + 2  # create_customer already loaded it
+
+    client.post('/charge_wallet', data=json.dumps({'amount': 25}), content_type='application/json')
+    assert client.get('/get_customer_by_username/gale12').json['wallet'] == 25
+
+    client.put('/update_customer_information', data=json.dumps({'age': 41}), content_type='application/json')
+    assert client.get('/get_customer_by_username/gale12').json['age'] == 41
+
+    client.delete('/delete_customer')
+    assert client.get('/get_customer_by_username/gale12').status_code == 404
+
+def test_database_invalidation_bus(client):
+    with app.app_context():
+        worker1 = ProfileCache(10, 30, DatabaseInvalidationBus())
+        worker2 = ProfileCache(10, 30, DatabaseInvalidationBus())
+        worker2.bus.poll()
+
+        _, token = worker2.get('gale12')
+        worker2.set('gale12', {'username': 'gale12'}, token)
+        assert worker2.get('gale12')[0] == {'username': 'gale12'}
+
+        worker1.invalidate('gale12')
+        assert worker2.get('gale12')[0] is not None
+        assert worker2.bus.poll() == 1
+        assert worker2.get('gale12')[0] is None
+
+def test_search_customers(client, customer1):
+    people = [
+        dict(customer1, username=f'person{i}', age=age, gender=gender, marital_status=status)
+        for i, (age, gender, status) in enumerate([
+            (25, 'female', 'single'), (35, 'male', 'married'), (45, 'female', 'single'),
+            (55, 'female', 'single'), (65, 'female', 'married'), (30, 'female', 'single'),
+        ])
+    ]
+    client.post('/customers/bulk_import', data=json.dumps(people), content_type='application/json')
+
+    res = client.get('/customers/search?gender=female&marital_status=single&min_age=26&sort=-age&limit=2')
+    assert res.status_code == 200
+    assert [c['age'] for c in res.json['customers']] == [55, 45]
+    assert all('password' not in c for c in res.json['customers'])
+
+    res = client.get(f"/customers/search?gender=female&marital_status=single&min_age=26&sort=-age&limit=2&cursor={res.json['next_cursor']}")
+    assert [c['age'] for c in res.json['customers']] == [30]
+    assert res.json['next_cursor'] is None
+
+    res = client.get('/customers/search?max_age=39&sort=age')
+    assert [c['username'] for c in res.json['customers']] == ['person0', 'person5', 'person1']
+
+    assert client.get('/customers/search?sort=password').status_code == 400
+    assert client.get('/customers/search?min_age=old').status_code == 400
+    for cursor in ['bogus', 'WyJhIiwgMV0=', 'WzEsICJ4Il0=', 'WzEsIDIsIDNd']:  # ["a", 1], [1, "x"], [1, 2, 3]
+        assert client.get(f'/customers/search?sort=age&cursor={cursor}').status_code == 400
+
+def test_search_customers_wallet_needs_row_engine(client, customer2, ledger_engine):
+    assert client.get('/customers/search?min_wallet=50').status_code == 400
+    assert client.get('/customers/search?sort=-wallet').status_code == 400
+    assert client.get('/customers/search?sort=age').status_code == 200
+
+def _query_plan(query):
+    sql = str(query.compile(db.engine, compile_kwargs={"literal_binds": True}))
+    if db.engine.dialect.name == 'sqlite':
+        rows = db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}')).all()
+        return ' '.join(row[-1] for row in rows)
+    rows = db.session.execute(db.text(f'EXPLAIN {sql}')).mappings().all()
+    return ' '.join(f"{row['table']}:{row['type']}:{row['key']}" for row in rows)
+
+def test_search_customers_uses_indexes(client, customer1):
+    # Skewed data so that every filter below is selective, as on a real customer table
+    filler = [dict(customer1, username=f'filler{i:03}', age=20, gender='male', marital_status='married')
+              for i in range(200)]
+    client.post('/customers/bulk_import', data=json.dumps(filler), content_type='application/json')
+    with app.app_context():
+        if db.engine.dialect.name == 'mysql':
+            db.session.execute(db.text('ANALYZE TABLE customer'))
+
+    cases = [
+        ({'gender': 'female', 'marital_status': 'single', 'min_age': '30'}, 'ix_customer_gender_marital_status_age'),
+        ({'min_age': '30', 'max_age': '40', 'sort': 'age'}, 'ix_customer_age_id'),
+        ({'min_wallet': '10', 'sort': '-wallet'}, 'ix_customer_wallet_id'),
+    ]
+    with app.app_context():
+        for args, index in cases:
+            query, _ = build_customer_search(MultiDict(args))
+            plan = _query_plan(query.limit(50))
+            assert index in plan, plan
+            assert 'SCAN customer' not in plan.replace(f'SCAN customer USING INDEX {index}', '')
+            assert ':ALL:' not in plan
+
+def test_username_autocomplete(client, customer1, customer2):
+    with app.app_context():
+        username_index.build()
+    for username in ['walter1', 'walt12', 'Waldo99']:
+        client.post('/create_customer', data=json.dumps(dict(customer1, username=username)),
+                    content_type='application/json')
+
+    res = client.get('/customers/autocomplete?prefix=wal')
+    assert res.json['usernames'] == ['Waldo99', 'walt12', 'walter1']
+    res = client.get('/customers/autocomplete?prefix=WALT&limit=1')
+    assert res.json['usernames'] == ['walt12']
+    assert client.get('/customers/autocomplete').status_code == 400
+
+    assert client.get('/customers/username_available/waldo99').json['available'] is False
+    assert client.get('/customers/username_available/jesse12').json['available'] is True
+
+    client.post('/login', data=json.dumps({"username": customer2['username'], "password": customer2['password']}),
+                content_type='application/json')
+    client.put('/update_customer_information', data=json.dumps({'username': 'gale_b'}), content_type='application/json')
+    assert client.get('/customers/username_available/gale12').json['available'] is True
+    assert client.get('/customers/autocomplete?prefix=gale').json['usernames'] == ['gale_b']
+
+
+def test_password_hashing(client, customer2):
+    with app.app_context():
+        stored = Customer.query.filter_by(username=customer2['username']).first()
+        assert stored.password != customer2['password']
+        assert stored.password.startswith('pbkdf2:sha256:1000$')
+        assert password_hasher.verify(stored.password, customer2['password'])
+        assert not password_hasher.verify(stored.password, 'wrong')
+
+        # Rows saved before hashing keep working and are upgraded on their next login
+        stored.password = customer2['password']
+        db.session.commit()
+
+    response = client.post('/login', data=json.dumps({"username": customer2['username'], "password": customer2['password']}),
+                           content_type='application/json')
+    assert response.status_code == 200
+    with app.app_context():
+        stored = Customer.query.filter_by(username=customer2['username']).first()
+        assert stored.password.startswith('pbkdf2:sha256:1000$')
+
+    response = client.post('/login', data=json.dumps({"username": customer2['username'], "password": "wrong"}),
+                           content_type='application/json')
+    assert response.status_code == 403
+
+    with app.app_context():
+        hashes = password_hasher.hash_many(["a", "b"])
+        assert password_hasher.verify(hashes[0], "a") and password_hasher.verify(hashes[1], "b")
+    assert client.get('/metrics').json['password_hasher']['pending'] == 0
+
+def test_scrypt_hash_fits_password_column(client, customer2, monkeypatch):
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', 'scrypt')
+    client.post('/login', data=json.dumps({"username": customer2['username'], "password": customer2['password']}),
+                content_type='application/json')
+    assert client.put('/update_customer_information', data=json.dumps({'password': 'n3w-secret'}),
+                      content_type='application/json').status_code == 200
+    with app.app_context():
+        stored = Customer.query.filter_by(username=customer2['username']).first().password
+        assert len(stored) <= Customer.__table__.c.password.type.length
+        assert password_hasher.verify(stored, 'n3w-secret')
+        assert migrate_customer_password_column() is False
+
+def test_hash_many_leaves_room_for_logins(monkeypatch):
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 2)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_MAX_PENDING', 8)
+    hasher = PasswordHasher()
+    queued = []
+
+    def generate(password, method):
+        # Jobs waiting behind this one in the pool; a login would wait behind them too
+        queued.append(hasher._executor._work_queue.qsize())
+        return generate_password_hash(password, method)
+
+    monkeypatch.setattr(customers_app, 'generate_password_hash', generate)
+    hashes = hasher.hash_many([str(i) for i in range(7)])
+    assert [hasher.verify(h, str(i)) for i, h in enumerate(hashes)] == [True] * 7
+    assert max(queued) <= 1
+    assert hasher.stats()['pending'] == 0
+
+def test_needs_rehash_with_shorthand_method(monkeypatch):
+    for method in ['pbkdf2', 'pbkdf2:sha512', 'pbkdf2:sha256:1000', 'scrypt']:
+        stored = generate_password_hash('secret', method)
+        assert stored.split('$', 1)[0] == normalize_hash_method(method)
+        monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', method)
+        assert not password_hasher.needs_rehash(stored)
+    assert password_hasher.needs_rehash(generate_password_hash('secret', 'pbkdf2:sha256:1000'))
+    assert password_hasher.needs_rehash('secret')
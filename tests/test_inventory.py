@@ -1,5 +1,9 @@
 from flask import json
-from ..inventory.app import app, db
+from ..inventory.app import app, db, stock_engine, GoodNotFoundError, OutOfStockError, Goods, StockReservation, sweep_expired_reservations, search_index, tokenize, GoodsChange, prune_goods_changes, GoodsStockShard, rollup_stock_shards, goods_summary
+import datetime
+from sqlalchemy import text, func, event
+from sqlalchemy.exc import OperationalError
+import threading
 import pytest
 
 @pytest.fixture
@@ -171,4 +175,541 @@ def test_decrease_stock(client, good1):
     
     response = client.post(f'/decrease_stock/{good1["name"]}')
     assert response.status_code == 400
-    assert response.json["error"] == "No stock available"
\ No newline at end of file
+    assert response.json["error"] == "No stock available"
+
+def test_decrease_stock_quantity(client, good1):
+    response = client.post(f'/decrease_stock/{good1["name"]}', json={"quantity": 10})
+    assert response.status_code == 200
+    assert response.json["new_count"] == good1["count_in_stock"] - 10
+
+    response = client.post(f'/decrease_stock/{good1["name"]}', json={"quantity": 41})
+    assert response.status_code == 400
+    assert response.json["error"] == "No stock available"
+
+    response = client.post(f'/decrease_stock/{good1["name"]}', json={"quantity": 0})
+    assert response.status_code == 400
+
+    response = client.get(f'/goods/{good1["name"]}')
+    assert response.json["count_in_stock"] == good1["count_in_stock"] - 10
+
+
+def test_stock_engine_concurrent_decrease(client, good1):
+    sold = []
+
+    def buyer():
+        with app.app_context():
+            for _ in range(10):
+                try:
+                    stock_engine.decrease(good1["name"])
+                    db.session.commit()
+                    sold.append(1)
+                except OutOfStockError:
+                    db.session.rollback()
+
+    threads = [threading.Thread(target=buyer) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(sold) == good1["count_in_stock"]
+    with app.app_context():
+        with pytest.raises(OutOfStockError):
+            stock_engine.decrease(good1["name"])
+        with pytest.raises(GoodNotFoundError):
+            stock_engine.decrease("non_existent_good")
+        db.session.rollback()
+    assert client.get(f'/goods/{good1["name"]}').json["count_in_stock"] == 0
+
+
+def test_duplicate_good_name(client, good1, good2):
+    response = client.post('/add_good', data=json.dumps(good1), content_type='application/json')
+    assert response.status_code == 409
+
+    client.post('/add_good', data=json.dumps(good2), content_type='application/json')
+    response = client.put('/update_good/2', data=json.dumps({"name": good1["name"]}), content_type='application/json')
+    assert response.status_code == 409
+
+
+def test_get_goods_batch(client, good1, good2):
+    client.post('/add_good', data=json.dumps(good2), content_type='application/json')
+
+    response = client.get(f'/goods/batch?names={good2["name"]},missing_good,{good1["name"]}')
+    assert response.status_code == 200
+    assert [g["name"] for g in response.json["goods"]] == [good2["name"], good1["name"]]
+    assert response.json["missing"] == ["missing_good"]
+
+    response = client.post('/goods/batch', json={"names": [good1["name"], "a,b"]})
+    assert response.status_code == 200
+    assert [g["name"] for g in response.json["goods"]] == [good1["name"]]
+    assert response.json["missing"] == ["a,b"]
+
+    assert client.get('/goods/batch').status_code == 400
+    assert client.post('/goods/batch', json={"names": "x"}).status_code == 400
+
+
+def test_migrate_goods_name_index(client, good1):
+    runner = app.test_cli_runner()
+    with app.app_context():
+        # Simulate a table created before the unique index existed
+        db.session.execute(text("DROP INDEX ix_goods_name" + (" ON goods" if db.engine.dialect.name == "mysql" else "")))
+        db.session.add(Goods(good1["name"], good1["category"], 1.0, "", 1))
+        db.session.commit()
+
+    result = runner.invoke(args=["migrate"])
+    assert result.exit_code != 0
+    assert f"{good1['name']} (2 rows)" in result.output
+
+    with app.app_context():
+        db.session.execute(db.delete(Goods).where(Goods.id == 2))
+        db.session.commit()
+
+    result = runner.invoke(args=["migrate"])
+    assert result.exit_code == 0
+    assert "Created unique index" in result.output
+    assert client.post('/add_good', data=json.dumps(good1), content_type='application/json').status_code == 409
+
+
+def test_reservations(client, good1):
+    response = client.post('/reservations', json={"name": good1["name"], "quantity": 5})
+    assert response.status_code == 201
+    first = response.json["reservation_id"]
+    assert response.json["new_count"] == good1["count_in_stock"] - 5
+
+    response = client.post('/reservations', json={"name": good1["name"], "quantity": 3})
+    second = response.json["reservation_id"]
+
+    data = client.get(f'/goods/{good1["name"]}').json
+    assert data["count_in_stock"] == good1["count_in_stock"] - 8
+    assert data["reserved_count"] == 8
+
+    assert client.post(f'/reservations/{first}/commit').status_code == 200
+    assert client.post(f'/reservations/{first}/release').status_code == 409
+    response = client.post(f'/reservations/{second}/release')
+    assert response.status_code == 200
+    assert response.json["new_count"] == good1["count_in_stock"] - 5
+    assert client.post(f'/reservations/{second}/commit').status_code == 409
+    assert client.get(f'/reservations/{second}').json["status"] == "released"
+
+    data = client.get(f'/goods/{good1["name"]}').json
+    assert data["count_in_stock"] == good1["count_in_stock"] - 5
+    assert data["reserved_count"] == 0
+
+    assert client.post('/reservations', json={"name": good1["name"], "quantity": 46}).status_code == 400
+    assert client.post('/reservations', json={"name": "non_existent_good"}).status_code == 404
+    assert client.post('/reservations/9999/commit').status_code == 404
+    for ttl_seconds in (0, -5, 10 ** 12, "60", 1.5, True, None):
+        response = client.post('/reservations', json={"name": good1["name"], "ttl_seconds": ttl_seconds})
+        assert response.status_code == 400
+    assert client.get(f'/goods/{good1["name"]}').json["reserved_count"] == 0
+
+
+def test_sweep_expired_reservations(client, good1):
+    response = client.post('/reservations', json={"name": good1["name"], "quantity": 4})
+    reservation_id = response.json["reservation_id"]
+    with app.app_context():
+        db.session.get(StockReservation, reservation_id).expires_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        db.session.commit()
+
+    assert client.post(f'/reservations/{reservation_id}/commit').json["error"] == "Reservation is expired"
+    with app.app_context():
+        assert sweep_expired_reservations() == 1
+        assert sweep_expired_reservations() == 0
+
+    assert client.get(f'/reservations/{reservation_id}').json["status"] == "expired"
+    assert client.get(f'/goods/{good1["name"]}').json["count_in_stock"] == good1["count_in_stock"]
+
+
+def test_get_all_goods_etag(client, good1):
+    response = client.get('/goods')
+    etag = response.headers["ETag"]
+    assert response.json[0]["count_in_stock"] == good1["count_in_stock"]
+
+    hits = client.get('/metrics').json["catalog"]["hits"]
+    response = client.get('/goods')
+    assert response.headers["ETag"] == etag
+    assert client.get('/metrics').json["catalog"]["hits"] == hits + 1
+
+    response = client.get('/goods', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    client.post(f'/decrease_stock/{good1["name"]}')
+    response = client.get('/goods', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json[0]["count_in_stock"] == good1["count_in_stock"] - 1
+
+
+def test_get_all_goods_not_modified_without_query(client, good1, monkeypatch):
+    monkeypatch.setitem(app.config, 'CATALOG_VERSION_CHECK_INTERVAL', 60)
+    etag = client.get('/goods').headers["ETag"]
+
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        assert client.get('/goods', headers={"If-None-Match": etag}).status_code == 304
+        assert client.get('/goods').headers["ETag"] == etag
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert statements == []
+
+
+def test_get_all_goods_sees_other_workers_writes(client, good1, monkeypatch):
+    monkeypatch.setitem(app.config, 'CHANGE_FEED_SETTLE_SECONDS', 0)
+    monkeypatch.setitem(app.config, 'CATALOG_VERSION_CHECK_INTERVAL', 0)
+    etag = client.get('/goods').headers["ETag"]
+    assert client.get('/goods', headers={"If-None-Match": etag}).status_code == 304
+
+    # Another worker's write: committed with its change feed entry, but never bumps this process
+    with app.app_context():
+        db.session.execute(text("UPDATE goods SET count_in_stock = 1"))
+        db.session.add(GoodsChange(kind='stock', name=good1["name"], data='{"count_in_stock": 1}'))
+        db.session.commit()
+
+    response = client.get('/goods', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json[0]["count_in_stock"] == 1
+
+
+def test_query_goods(client):
+    with app.app_context():
+        db.session.add_all([
+            Goods("Laptop", "electronics", 899.0, "", 3),
+            Goods("Headphones", "electronics", 59.0, "", 0),
+            Goods("Charger", "electronics", 19.0, "", 10),
+            Goods("Jacket", "clothes", 120.0, "", 4),
+            Goods("Banana", "food", 0.5, "", 100),
+        ])
+        db.session.commit()
+
+    response = client.get('/goods/query?category=electronics&max_price=500&in_stock=true&sort=price')
+    assert response.status_code == 200
+    assert [g["name"] for g in response.json["goods"]] == ["Charger", "Smartphone"]
+    assert response.json["next_cursor"] is None
+    assert response.json["facets"]["category"] == {"electronics": 2, "clothes": 1, "food": 1}
+
+    names, cursor = [], None
+    while True:
+        url = '/goods/query?sort=-price&limit=2' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(url).json
+        assert ("facets" in page) == (cursor is None)
+        names += [g["name"] for g in page["goods"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert names == ["Laptop", "Smartphone", "Jacket", "Headphones", "Charger", "Banana"]
+
+    response = client.get('/goods/query?category=clothes,food&sort=name')
+    assert [g["name"] for g in response.json["goods"]] == ["Banana", "Jacket"]
+
+    assert client.get('/goods/query?sort=description').status_code == 400
+    assert client.get('/goods/query?min_price=cheap').status_code == 400
+    assert client.get('/goods/query?in_stock=maybe').status_code == 400
+    assert client.get('/goods/query?cursor=bogus').status_code == 400
+    for sort, cursor in [('price', 'W3t9LCAieCJd'), ('price', 'WyJjaGVhcCIsIDFd'),  # [{}, "x"], ["cheap", 1]
+                         ('-price', 'WzEuNSwgIngiXQ=='), ('name', 'WzEwLCAxXQ==')]:  # [1.5, "x"], [10, 1]
+        assert client.get(f'/goods/query?sort={sort}&cursor={cursor}').status_code == 400
+    assert client.get('/goods/query?sort=price&cursor=WzEwLCAxXQ==').status_code == 200  # [10, 1]
+
+
+def test_search_goods(client, good1, good2):
+    with app.app_context():
+        search_index.build()
+    client.post('/add_good', data=json.dumps(good2), content_type='application/json')
+    client.post('/add_good', data=json.dumps(dict(good1, name="Phone Case", category="accessories",
+                                                  description="Fits any smartphone.")), content_type='application/json')
+    assert tokenize("High-end Smartphone!") == ["high", "end", "smartphone"]
+
+    response = client.get('/goods/search?q=smartphone')
+    assert response.status_code == 200
+    assert [g["name"] for g in response.json["goods"]] == ["Smartphone", "Phone Case"]
+    assert response.json["goods"][0]["score"] > response.json["goods"][1]["score"]
+
+    # The last word is a prefix; the others must match whole words
+    assert [g["name"] for g in client.get('/goods/search?q=red gran').json["goods"]] == ["Apple"]
+    assert client.get('/goods/search?q=re granny').json["goods"] == []
+    assert client.get('/goods/search?q=').status_code == 400
+
+    client.put('/update_good/2', data=json.dumps({"name": "Green Apple"}), content_type='application/json')
+    assert [g["name"] for g in client.get('/goods/search?q=green').json["goods"]] == ["Green Apple"]
+    client.delete('/delete_good/1')
+    assert [g["name"] for g in client.get('/goods/search?q=smartph').json["goods"]] == ["Phone Case"]
+    with app.app_context():
+        # "great" only appeared in the deleted Smartphone's description
+        assert search_index.complete("gr", 10) == ["granny", "green"]
+
+
+def test_goods_change_feed(client, good1, good2):
+    settle = app.config['CHANGE_FEED_SETTLE_SECONDS']
+    app.config['CHANGE_FEED_SETTLE_SECONDS'] = 0
+    try:
+        client.post('/add_good', data=json.dumps(good2), content_type='application/json')
+        client.put('/update_good/2', data=json.dumps({"name": "Green Apple"}), content_type='application/json')
+        client.post(f'/decrease_stock/{good1["name"]}', json={"quantity": 2})
+        client.delete('/delete_good/2')
+
+        response = client.get('/goods/changes?since=0')
+        assert response.status_code == 200
+        changes = response.json["changes"]
+        assert [(c["kind"], c["name"]) for c in changes] == [
+            ("create", good1["name"]), ("create", "Apple"), ("update", "Green Apple"),
+            ("stock", good1["name"]), ("delete", "Green Apple")]
+        assert changes[2]["good_id"] == 2 and changes[2]["good"]["name"] == "Green Apple"
+        assert changes[3]["good"] == {"count_in_stock": good1["count_in_stock"] - 2}
+        assert response.json["last_seq"] == changes[-1]["seq"]
+
+        response = client.get(f'/goods/changes?since={changes[1]["seq"]}&limit=2')
+        assert [c["kind"] for c in response.json["changes"]] == ["update", "stock"]
+        response = client.get(f'/goods/changes?since={changes[-1]["seq"]}&wait=0.1')
+        assert response.json == {"changes": [], "last_seq": changes[-1]["seq"]}
+
+        snapshot = client.get('/goods/snapshot').json
+        assert snapshot["seq"] == changes[-1]["seq"]
+        assert [g["name"] for g in snapshot["goods"]] == [good1["name"]]
+
+        # Readers behind the pruned part of the feed are told to take a new snapshot
+        with app.app_context():
+            db.session.execute(db.delete(GoodsChange).where(GoodsChange.seq <= changes[2]["seq"]))
+            db.session.commit()
+        assert client.get(f'/goods/changes?since={changes[0]["seq"]}').status_code == 410
+        assert client.get(f'/goods/changes?since={changes[2]["seq"]}').status_code == 200
+        with app.app_context():
+            assert prune_goods_changes() == 0
+    finally:
+        app.config['CHANGE_FEED_SETTLE_SECONDS'] = settle
+
+
+def test_goods_change_feed_waits_for_missing_seq(client, good1):
+    settle = app.config['CHANGE_FEED_SETTLE_SECONDS']
+    app.config['CHANGE_FEED_SETTLE_SECONDS'] = 0
+    try:
+        with app.app_context():
+            # Seq 2 was handed to a transaction that has not committed yet
+            db.session.add(GoodsChange(seq=3, kind='stock', name=good1["name"], data='{"count_in_stock": 9}'))
+            db.session.commit()
+        response = client.get('/goods/changes?since=1')
+        assert response.json == {"changes": [], "last_seq": 1}
+        assert client.get('/goods/snapshot').json["seq"] == 1
+
+        with app.app_context():
+            db.session.add(GoodsChange(seq=2, kind='stock', name=good1["name"], data='{"count_in_stock": 10}'))
+            db.session.commit()
+        response = client.get('/goods/changes?since=1')
+        assert [c["seq"] for c in response.json["changes"]] == [2, 3]
+        assert client.get('/goods/snapshot').json["seq"] == 3
+
+        # A number still missing after CHANGE_FEED_GAP_SECONDS was rolled back
+        with app.app_context():
+            db.session.add(GoodsChange(seq=5, kind='stock', name=good1["name"], data='{"count_in_stock": 8}',
+                                       created_at=datetime.datetime.utcnow() - datetime.timedelta(minutes=1)))
+            db.session.commit()
+        assert [c["seq"] for c in client.get('/goods/changes?since=3').json["changes"]] == [5]
+        assert client.get('/goods/snapshot').json["seq"] == 5
+
+        for _ in range(110):  # Replicas polling back to back are not rate limited
+            assert client.get('/goods/changes?since=5').status_code == 200
+        assert client.get('/goods/snapshot').status_code == 200
+    finally:
+        app.config['CHANGE_FEED_SETTLE_SECONDS'] = settle
+
+
+def test_increase_stock(client, good1):
+    response = client.post(f'/increase_stock/{good1["name"]}', json={"quantity": 3})
+    assert response.status_code == 200 and response.json["new_count"] == good1["count_in_stock"] + 3
+    assert client.post(f'/increase_stock/{good1["name"]}').json["new_count"] == good1["count_in_stock"] + 4
+    assert client.post(f'/increase_stock/{good1["name"]}', json={"quantity": 0}).status_code == 400
+    assert client.post('/increase_stock/Unknown').status_code == 404
+
+def test_bulk_upsert_goods(client, good1):
+    settle = app.config['CHANGE_FEED_SETTLE_SECONDS']
+    app.config['CHANGE_FEED_SETTLE_SECONDS'] = 0
+    app.config['GOODS_BULK_BATCH_SIZE'] = 2
+    try:
+        body = ("name,category,price_per_item,description,count_in_stock\n"
+                "Smartphone,electronics,249.99,Discounted,40\n"
+                "Laptop,electronics,999,Thin and light,7\n"
+                "Cable,electronics,cheap,,3\n")
+        response = client.post('/goods/bulk_upsert', data=body, content_type='text/csv')
+        assert response.status_code == 200
+        assert response.json["inserted"] == 1 and response.json["updated"] == 1
+        assert [f["row"] for f in response.json["failed"]] == [3]
+        assert "price_per_item" in response.json["failed"][0]["errors"]
+
+        smartphone = client.get(f'/goods/{good1["name"]}').json
+        assert smartphone["price_per_item"] == 249.99 and smartphone["count_in_stock"] == 40
+        assert client.get('/goods/Laptop').json["description"] == "Thin and light"
+        assert [g["name"] for g in client.get('/goods/search?q=thin').json["goods"]] == ["Laptop"]
+
+        lines = [json.dumps({"name": "Mouse", "category": "electronics", "price_per_item": 19.5, "count_in_stock": 12}),
+                 "not json",
+                 json.dumps({"name": "Desk", "category": "furniture"}),
+                 json.dumps({"name": "Mouse", "category": "electronics", "price_per_item": 17.5, "count_in_stock": 10})]
+        response = client.post('/goods/bulk_upsert', data="\n".join(lines), content_type='application/x-ndjson')
+        assert response.status_code == 200
+        assert response.json["inserted"] == 1 and response.json["updated"] == 1  # Second Mouse is in the next batch
+        assert [f["row"] for f in response.json["failed"]] == [2, 3]
+        assert client.get('/goods/Mouse').json["price_per_item"] == 17.5
+
+        changes = client.get('/goods/changes?since=0').json["changes"]
+        assert [(c["kind"], c["name"]) for c in changes[1:]] == [
+            ("update", "Smartphone"), ("create", "Laptop"), ("create", "Mouse"), ("update", "Mouse")]
+
+        # Rows the columns cannot hold fail on their own; the rest of their batch is written
+        app.config['GOODS_BULK_BATCH_SIZE'] = 1000
+        good = {"category": "electronics", "price_per_item": 5.0, "count_in_stock": 1}
+        lines = [json.dumps(dict(good, name="Keyboard")),
+                 json.dumps(dict(good, name="K" * 101)),
+                 json.dumps(dict(good, name="Monitor", description="d" * 256)),
+                 json.dumps(dict(good, name=["Webcam"])),
+                 json.dumps(dict(good, name="Speaker", count_in_stock=2 ** 40)),
+                 json.dumps(dict(good, name="Headset"))]
+        response = client.post('/goods/bulk_upsert', data="\n".join(lines), content_type='application/x-ndjson')
+        assert response.status_code == 200
+        assert response.json["inserted"] == 2
+        assert [(f["row"], list(f["errors"])) for f in response.json["failed"]] == [
+            (2, ["name"]), (3, ["description"]), (4, ["name"]), (5, ["count_in_stock"])]
+        for name in ("Keyboard", "Headset"):
+            assert client.get(f'/goods/{name}').status_code == 200
+
+        # Names differing only in case are the same good under MySQL's default collation
+        lines = [json.dumps(dict(good, name="Tablet")),
+                 json.dumps(dict(good, name="tablet", price_per_item=6.0)),
+                 json.dumps(dict(good, name="Keyboard", price_per_item=7.0))]
+        response = client.post('/goods/bulk_upsert', data="\n".join(lines), content_type='application/x-ndjson')
+        assert response.status_code == 200
+        assert response.json["inserted"] == 1 and response.json["updated"] == 1
+        assert [(f["row"], list(f["errors"])) for f in response.json["failed"]] == [(2, ["name"])]
+        assert client.get('/goods/Tablet').json["price_per_item"] == 5.0
+        assert client.get('/goods/tablet').status_code == 404
+
+        assert client.post('/goods/bulk_upsert', json=[good1]).status_code == 415
+    finally:
+        app.config['CHANGE_FEED_SETTLE_SECONDS'] = settle
+        app.config['GOODS_BULK_BATCH_SIZE'] = 1000
+
+
+def test_stock_write_retried_after_deadlock(client, good1, monkeypatch):
+    name = good1["name"]
+    assert client.put(f'/goods/{name}/stock_shards', json={"shards": 4}).status_code == 200
+    decrease = stock_engine.decrease
+    calls = []
+
+    def deadlock_once(*args):
+        calls.append(args)
+        new_count = decrease(*args)  # Its writes are rolled back with the victim's transaction
+        if len(calls) == 1:
+            raise OperationalError("UPDATE goods_stock_shard", {}, Exception(1213, "Deadlock found"))
+        return new_count
+
+    monkeypatch.setattr(stock_engine, 'decrease', deadlock_once)
+    response = client.post(f'/decrease_stock/{name}', json={"quantity": 3})
+    assert response.status_code == 200 and response.json["new_count"] == good1["count_in_stock"] - 3
+    assert len(calls) == 2
+
+    calls.clear()
+    response = client.post('/goods/batch/decrease_stock', json={"items": [{"name": name, "quantity": 2}]})
+    assert response.status_code == 200 and response.json["new_counts"] == {name: good1["count_in_stock"] - 5}
+
+    monkeypatch.setitem(app.config, 'DEADLOCK_RETRIES', 0)
+    calls.clear()
+    assert client.post('/reservations', json={"name": name}).status_code == 500
+    assert client.get(f'/goods/{name}').json["count_in_stock"] == good1["count_in_stock"] - 5
+
+
+def test_stock_shards(client, good1):
+    name = good1["name"]
+    assert client.put(f'/goods/{name}/stock_shards', json={"shards": 65}).status_code == 400
+    assert client.put('/goods/Unknown/stock_shards', json={"shards": 4}).status_code == 404
+
+    response = client.put(f'/goods/{name}/stock_shards', json={"shards": 4})
+    assert response.status_code == 200
+    assert response.json == {"name": name, "stock_shards": 4, "count_in_stock": 50}
+    with app.app_context():
+        counts = db.session.execute(db.select(GoodsStockShard.count_in_stock).order_by(GoodsStockShard.shard)).scalars().all()
+    assert counts == [13, 13, 12, 12]
+
+    for _ in range(5):
+        assert client.post(f'/decrease_stock/{name}').status_code == 200
+    # No single shard holds 20 units, so they are drained together
+    response = client.post(f'/decrease_stock/{name}', json={"quantity": 20})
+    assert response.status_code == 200 and response.json["new_count"] == 25
+    assert client.post(f'/decrease_stock/{name}', json={"quantity": 26}).status_code == 400
+    response = client.post('/reservations', json={"name": name, "quantity": 5})
+    assert response.json["new_count"] == 20
+    assert client.post(f'/reservations/{response.json["reservation_id"]}/release').json["new_count"] == 25
+
+    good = client.get(f'/goods/{name}').json
+    assert good["count_in_stock"] == 25 and good["stock_shards"] == 4
+    with app.app_context():
+        assert db.session.get(Goods, 1).count_in_stock == 50  # Cached total until the rollup
+        assert rollup_stock_shards() == 1
+        assert db.session.get(Goods, 1).count_in_stock == 25
+        assert rollup_stock_shards() == 0
+
+    client.put('/update_good/1', json={"count_in_stock": 40})
+    assert client.post(f'/decrease_stock/{name}', json={"quantity": 10}).json["new_count"] == 30
+
+    response = client.put(f'/goods/{name}/stock_shards', json={"shards": 0})
+    assert response.json["count_in_stock"] == 30
+    with app.app_context():
+        assert db.session.execute(db.select(func.count()).select_from(GoodsStockShard)).scalar() == 0
+    assert client.post(f'/decrease_stock/{name}').json["new_count"] == 29
+
+
+def test_goods_summary(client, good1, good2):
+    with app.app_context():
+        goods_summary.build()
+    client.post('/add_good', data=json.dumps(good2), content_type='application/json')
+    response = client.get('/goods/summary?low_stock_threshold=40')
+    assert response.status_code == 200
+    assert response.json["categories"] == [
+        {"category": "electronics", "goods": 1, "units_in_stock": 50, "stock_value": 14999.5, "low_stock": 0, "out_of_stock": 0},
+        {"category": "food", "goods": 1, "units_in_stock": good2["count_in_stock"],
+         "stock_value": round(good2["price_per_item"] * good2["count_in_stock"], 2),
+         "low_stock": int(good2["count_in_stock"] <= 40), "out_of_stock": 0}]
+
+    client.post(f'/decrease_stock/{good1["name"]}', json={"quantity": 15})
+    client.post(f'/decrease_stock/{good1["name"]}', json={"quantity": 100})  # Rolled back, not counted
+    client.put('/update_good/2', json={"category": "electronics", "count_in_stock": 0})
+    summary = client.get('/goods/summary?low_stock_threshold=40').json
+    assert [c["category"] for c in summary["categories"]] == ["electronics"]
+    assert summary["categories"][0]["units_in_stock"] == 35
+    assert summary["categories"][0]["low_stock"] == 2 and summary["categories"][0]["out_of_stock"] == 1
+    assert summary["totals"]["stock_value"] == round(299.99 * 35, 2)
+    assert client.get('/goods/summary').json["categories"][0]["low_stock"] == 1
+
+    client.delete('/delete_good/2')
+    client.put(f'/goods/{good1["name"]}/stock_shards', json={"shards": 4})
+    client.post(f'/decrease_stock/{good1["name"]}', json={"quantity": 5})
+    summary = client.get('/goods/summary').json
+    assert summary["totals"]["goods"] == 1 and summary["totals"]["units_in_stock"] == 30
+    with app.app_context():
+        assert goods_summary.build() == 1
+    assert client.get('/goods/summary').json == summary
+    assert client.get('/goods/summary?low_stock_threshold=-1').status_code == 400
+
+
+def test_batch_stock_updates(client, good1, good2):
+    client.post('/add_good', data=json.dumps(good2), content_type='application/json')
+    items = [{"name": good1["name"], "quantity": 2}, {"name": good2["name"]}, {"name": good1["name"], "quantity": 3}]
+    response = client.post('/goods/batch/decrease_stock', json={"items": items})
+    assert response.status_code == 200
+    assert response.json["new_counts"] == {good2["name"]: good2["count_in_stock"] - 1, good1["name"]: good1["count_in_stock"] - 5}
+
+    # All or nothing: the Apple decrement is rolled back with the failed Smartphone one
+    response = client.post('/goods/batch/decrease_stock', json={"items": [
+        {"name": good2["name"], "quantity": 1}, {"name": good1["name"], "quantity": 1000}]})
+    assert response.status_code == 400 and response.json["name"] == good1["name"]
+    response = client.post('/goods/batch/decrease_stock', json={"items": [{"name": "Unknown"}]})
+    assert response.status_code == 404 and response.json["name"] == "Unknown"
+    assert client.get(f'/goods/{good2["name"]}').json["count_in_stock"] == good2["count_in_stock"] - 1
+
+    response = client.post('/goods/batch/increase_stock', json={"items": items})
+    assert response.json["new_counts"] == {good2["name"]: good2["count_in_stock"], good1["name"]: good1["count_in_stock"]}
+    assert client.post('/goods/batch/decrease_stock', json={"items": [{"name": good1["name"], "quantity": 0}]}).status_code == 400
+    assert client.post('/goods/batch/decrease_stock', json={"items": []}).status_code == 400
@@ -37,7 +37,7 @@ def test_submit_review(client):
     token = create_token(username)
 
     # Mock the requests.get call to the inventory service
-    with patch('reviews.app.requests.get') as mock_get:
+    with patch('reviews.app.requests.Session.get') as mock_get:
         # Mock response for product verification
         mock_response = MagicMock()
         mock_response.status_code = 200
@@ -125,7 +125,7 @@ def test_submit_review_product_not_found(client):
     token = create_token(username)
 
     # Mock the requests.get call to the inventory service to simulate product not found
-    with patch('reviews.app.requests.get') as mock_get:
+    with patch('reviews.app.requests.Session.get') as mock_get:
         mock_response = MagicMock()
         mock_response.status_code = 404
         mock_response.json.return_value = {'error': 'Product not found'}
@@ -1,9 +1,11 @@
 from flask import json
-from ..sales.app import app, db, SECRET_KEY, Purchase
+from ..sales.app import app, db, SECRET_KEY, Purchase, catalog_replica, catalog_cache, CatalogCache
 import pytest
 import jwt
 import datetime
+import time
 from unittest.mock import patch, MagicMock
+from pybreaker import CircuitBreakerError
 
 @pytest.fixture
 def client():
@@ -12,6 +14,7 @@ def client():
         with app.app_context():
             db.drop_all()
             db.create_all()  # Fresh DB for each test
+        catalog_cache.clear()
         yield client
 
 def create_token(username):
@@ -28,7 +31,7 @@ def create_token(username):
 
 def test_display_goods(client):
     # Mock the requests.get call to the inventory service
-    with patch('sales.app.requests.get') as mock_get:
+    with patch('sales.app.requests.Session.get') as mock_get:
         # Set up the mock response data
         mock_goods = [
             {
@@ -73,7 +76,7 @@ def test_display_goods(client):
         assert data == expected_goods_list
 
 def test_get_good_details(client):
-    with patch('sales.app.requests.get') as mock_get:
+    with patch('sales.app.requests.Session.get') as mock_get:
         # Set up the mock response data
         mock_good = {
             'name': 'Apple',
@@ -134,7 +137,7 @@ def test_make_sale(client):
     }
 
     # Mock the requests
-    with patch('sales.app.requests.get') as mock_get, patch('sales.app.requests.post') as mock_post:
+    with patch('sales.app.requests.Session.get') as mock_get, patch('sales.app.requests.Session.post') as mock_post:
         # Mock requests.get to inventory service for good details
         mock_response_good = MagicMock()
         mock_response_good.status_code = 200
@@ -155,10 +158,14 @@ def test_make_sale(client):
 
         mock_get.side_effect = side_effect_get
 
-        # Mock requests.post to customers service to deduct wallet
-        mock_response_deduct = MagicMock()
-        mock_response_deduct.status_code = 200
-        mock_response_deduct.json.return_value = {'message': 'Money deducted successfully', 'new_balance': customer['wallet'] - good['price_per_item']}
+        # Mock requests.post to customers service to place and capture a wallet hold
+        mock_response_hold = MagicMock()
+        mock_response_hold.status_code = 201
+        mock_response_hold.json.return_value = {'message': 'Hold authorized', 'hold_id': 7, 'new_balance': customer['wallet'] - good['price_per_item']}
+
+        mock_response_capture = MagicMock()
+        mock_response_capture.status_code = 200
+        mock_response_capture.json.return_value = {'message': 'Hold captured', 'hold_id': 7}
 
         # Mock requests.post to inventory service to decrease stock
         mock_response_decrease_stock = MagicMock()
@@ -166,8 +173,10 @@ def test_make_sale(client):
         mock_response_decrease_stock.json.return_value = {'message': 'Stock decreased', 'new_count': good['count_in_stock'] - 1}
 
         def side_effect_post(url, *args, **kwargs):
-            if url == f'http://customers:5001/deduct_wallet':
-                return mock_response_deduct
+            if url == 'http://customers:5001/wallet/holds':
+                return mock_response_hold
+            elif url == 'http://customers:5001/wallet/holds/7/capture':
+                return mock_response_capture
             elif url == f'http://inventory:5001/decrease_stock/{good_name}':
                 return mock_response_decrease_stock
             else:
@@ -216,6 +225,40 @@ def test_get_purchase_history(client):
     assert data[0]['good_name'] in ['Apple', 'Banana']
     assert data[1]['good_name'] in ['Apple', 'Banana']
 
+def test_purchase_history_pages_and_filters(client):
+    username = 'testuser'
+    token = create_token(username)
+    with app.app_context():
+        for day in range(1, 6):
+            purchase = Purchase(customer_username=username, good_name=f'Good{day}', price=1.0)
+            purchase.purchase_date = datetime.datetime(2024, 1, day, 12)
+            db.session.add(purchase)
+        db.session.add(Purchase(customer_username='otheruser', good_name='Other', price=1.0))
+        db.session.commit()
+
+    response = client.get('/purchase_history?limit=2', headers={'Authorization': token})
+    assert response.status_code == 200
+    assert [p['good_name'] for p in response.get_json()] == ['Good5', 'Good4']
+    cursor = response.headers['X-Next-Cursor']
+
+    response = client.get(f'/purchase_history?limit=2&cursor={cursor}', headers={'Authorization': token})
+    assert [p['good_name'] for p in response.get_json()] == ['Good3', 'Good2']
+    response = client.get(f'/purchase_history?limit=2&cursor={response.headers["X-Next-Cursor"]}',
+                          headers={'Authorization': token})
+    assert [p['good_name'] for p in response.get_json()] == ['Good1']
+    assert 'X-Next-Cursor' not in response.headers
+
+    response = client.get('/purchase_history?from=2024-01-02&to=2024-01-04', headers={'Authorization': token})
+    assert [p['good_name'] for p in response.get_json()] == ['Good3', 'Good2']
+
+    response = client.get(f'/purchase_history?format=ndjson&cursor={cursor}', headers={'Authorization': token})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [p['good_name'] for p in lines] == ['Good3', 'Good2', 'Good1']
+
+    assert client.get('/purchase_history?cursor=bogus', headers={'Authorization': token}).status_code == 400
+    assert client.get('/purchase_history?from=yesterday', headers={'Authorization': token}).status_code == 400
+
 def test_make_sale_insufficient_funds(client):
     # Create a test user token
     username = 'testuser'
@@ -245,7 +288,7 @@ def test_make_sale_insufficient_funds(client):
     }
 
     # Mock the requests
-    with patch('sales.app.requests.get') as mock_get, patch('sales.app.requests.post') as mock_post:
+    with patch('sales.app.requests.Session.get') as mock_get, patch('sales.app.requests.Session.post') as mock_post:
         # Mock requests.get to inventory service for good details
         mock_response_good = MagicMock()
         mock_response_good.status_code = 200
@@ -266,6 +309,19 @@ def test_make_sale_insufficient_funds(client):
 
         mock_get.side_effect = side_effect_get
 
+        # Mock requests.post to customers service: the hold is refused
+        mock_response_hold = MagicMock()
+        mock_response_hold.status_code = 400
+        mock_response_hold.json.return_value = {'error': 'Insufficient funds'}
+
+        def side_effect_post(url, *args, **kwargs):
+            if url == 'http://customers:5001/wallet/holds':
+                return mock_response_hold
+            else:
+                raise ValueError('Unmocked url in post: ' + url)
+
+        mock_post.side_effect = side_effect_post
+
         # Make the request to /sale
         response = client.post('/sale',
                                data=json.dumps({'name': good_name}),
@@ -305,7 +361,7 @@ def test_make_sale_good_out_of_stock(client):
     }
 
     # Mock the requests
-    with patch('sales.app.requests.get') as mock_get, patch('sales.app.requests.post') as mock_post:
+    with patch('sales.app.requests.Session.get') as mock_get, patch('sales.app.requests.Session.post') as mock_post:
         # Mock requests.get to inventory service for good details
         mock_response_good = MagicMock()
         mock_response_good.status_code = 200
@@ -335,3 +391,263 @@ def test_make_sale_good_out_of_stock(client):
         data = response.get_json()
         assert response.status_code == 400
         assert data['error'] == 'Good is out of stock'
+
+def test_make_sale_voids_hold_when_stock_update_fails(client):
+    username = 'testuser'
+    token = create_token(username)
+    good = {
+        'name': 'Apple',
+        'category': 'food',
+        'price_per_item': 1.0,
+        'description': 'Fresh apple',
+        'count_in_stock': 1
+    }
+
+    with patch('sales.app.requests.Session.get') as mock_get, patch('sales.app.requests.Session.post') as mock_post:
+        mock_response_good = MagicMock()
+        mock_response_good.status_code = 200
+        mock_response_good.json.return_value = good
+        mock_get.return_value = mock_response_good
+
+        mock_response_hold = MagicMock()
+        mock_response_hold.status_code = 201
+        mock_response_hold.json.return_value = {'hold_id': 3}
+
+        mock_response_decrease_stock = MagicMock()
+        mock_response_decrease_stock.status_code = 400
+
+        mock_response_void = MagicMock()
+        mock_response_void.status_code = 200
+
+        def side_effect_post(url, *args, **kwargs):
+            if url == 'http://customers:5001/wallet/holds':
+                return mock_response_hold
+            elif url == 'http://inventory:5001/decrease_stock/Apple':
+                return mock_response_decrease_stock
+            elif url == 'http://customers:5001/wallet/holds/3/void':
+                return mock_response_void
+            else:
+                raise ValueError('Unmocked url in post: ' + url)
+
+        mock_post.side_effect = side_effect_post
+
+        response = client.post('/sale',
+                               data=json.dumps({'name': 'Apple'}),
+                               content_type='application/json',
+                               headers={'Authorization': token})
+
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'Failed to update good stock'
+        posted = [call.args[0] for call in mock_post.call_args_list]
+        assert 'http://customers:5001/wallet/holds/3/void' in posted
+
+        with app.app_context():
+            assert Purchase.query.count() == 0
+
+def test_make_sale_leaves_stock_alone_when_hold_fails(client):
+    token = create_token('testuser')
+    good = {'name': 'Apple', 'category': 'food', 'price_per_item': 1.0, 'description': 'Fresh apple', 'count_in_stock': 4}
+
+    with patch('sales.app.requests.Session.get') as mock_get, patch('sales.app.requests.Session.post') as mock_post:
+        mock_get.return_value = MagicMock(status_code=200, json=MagicMock(return_value=good))
+        responses = {
+            'http://customers:5001/wallet/holds': MagicMock(status_code=400),
+        }
+        mock_post.side_effect = lambda url, *args, **kwargs: responses[url]
+
+        response = client.post('/sale',
+                               data=json.dumps({'name': 'Apple'}),
+                               content_type='application/json',
+                               headers={'Authorization': token})
+
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'Insufficient funds'
+        # The stock is only touched once the funds are held
+        posted = [call.args[0] for call in mock_post.call_args_list]
+        assert posted == ['http://customers:5001/wallet/holds']
+
+        with app.app_context():
+            assert Purchase.query.count() == 0
+
+def test_make_sale_undone_when_capture_fails(client):
+    token = create_token('testuser')
+    good = {'name': 'Apple', 'category': 'food', 'price_per_item': 1.0, 'description': 'Fresh apple', 'count_in_stock': 4}
+
+    with patch('sales.app.requests.Session.get') as mock_get, patch('sales.app.requests.Session.post') as mock_post:
+        mock_get.return_value = MagicMock(status_code=200, json=MagicMock(return_value=good))
+        responses = {
+            'http://customers:5001/wallet/holds': MagicMock(status_code=201, json=MagicMock(return_value={'hold_id': 3})),
+            'http://inventory:5001/decrease_stock/Apple': MagicMock(status_code=200),
+            'http://customers:5001/wallet/holds/3/capture': MagicMock(status_code=409),
+            'http://customers:5001/wallet/holds/3/void': MagicMock(status_code=200),
+            'http://inventory:5001/increase_stock/Apple': MagicMock(status_code=200),
+        }
+        mock_post.side_effect = lambda url, *args, **kwargs: responses[url]
+
+        response = client.post('/sale', json={'name': 'Apple'}, headers={'Authorization': token})
+
+        assert response.status_code == 409
+        assert sorted(call.args[0] for call in mock_post.call_args_list) == sorted(responses)
+        with app.app_context():
+            assert Purchase.query.count() == 0
+
+def test_checkout(client):
+    token = create_token('testuser')
+    goods = [
+        {'name': 'Apple', 'category': 'food', 'price_per_item': 0.5, 'description': '', 'count_in_stock': 10},
+        {'name': 'T-Shirt', 'category': 'clothes', 'price_per_item': 20.0, 'description': '', 'count_in_stock': 3},
+    ]
+    items = [{'name': 'Apple', 'quantity': 3}, {'name': 'T-Shirt'}, {'name': 'Apple'}]
+
+    with patch('sales.app.requests.Session.post') as mock_post:
+        stock = MagicMock(status_code=200)
+        responses = {
+            'http://inventory:5001/goods/batch': MagicMock(status_code=200, json=MagicMock(return_value={'goods': goods, 'missing': []})),
+            'http://inventory:5001/goods/batch/decrease_stock': stock,
+            'http://customers:5001/wallet/holds': MagicMock(status_code=201, json=MagicMock(return_value={'hold_id': 9})),
+            'http://customers:5001/wallet/holds/9/capture': MagicMock(status_code=200),
+            'http://customers:5001/wallet/holds/9/void': MagicMock(status_code=200),
+        }
+        mock_post.side_effect = lambda url, *args, **kwargs: responses[url]
+
+        response = client.post('/checkout', json={'items': items}, headers={'Authorization': token})
+        assert response.status_code == 200
+        assert response.get_json()['total'] == 22.0
+        calls = {call.args[0]: call.kwargs for call in mock_post.call_args_list}
+        assert len(mock_post.call_args_list) == 4
+        assert calls['http://inventory:5001/goods/batch']['json'] == {'names': ['Apple', 'T-Shirt']}
+        assert calls['http://customers:5001/wallet/holds']['json'] == {'amount': 22.0}
+        assert calls['http://inventory:5001/goods/batch/decrease_stock']['json'] == {
+            'items': [{'name': 'Apple', 'quantity': 4}, {'name': 'T-Shirt', 'quantity': 1}]}
+        with app.app_context():
+            assert sorted(p.good_name for p in Purchase.query.all()) == ['Apple'] * 4 + ['T-Shirt']
+
+        # A line running out of stock meanwhile voids the hold and records nothing
+        stock.status_code = 400
+        stock.json.return_value = {'error': 'No stock available', 'name': 'T-Shirt'}
+        mock_post.reset_mock()
+        response = client.post('/checkout', json={'items': items}, headers={'Authorization': token})
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'Good is out of stock', 'names': ['T-Shirt']}
+        assert 'http://customers:5001/wallet/holds/9/void' in [call.args[0] for call in mock_post.call_args_list]
+        with app.app_context():
+            assert Purchase.query.count() == 5
+
+        # A failed capture voids the hold and puts every line back
+        stock.status_code = 200
+        responses['http://customers:5001/wallet/holds/9/capture'] = MagicMock(status_code=503)
+        responses['http://inventory:5001/goods/batch/increase_stock'] = MagicMock(status_code=200)
+        mock_post.reset_mock()
+        response = client.post('/checkout', json={'items': items}, headers={'Authorization': token})
+        assert response.status_code == 503
+        calls = {call.args[0]: call.kwargs for call in mock_post.call_args_list}
+        assert 'http://customers:5001/wallet/holds/9/void' in calls
+        assert calls['http://inventory:5001/goods/batch/increase_stock']['json'] == {
+            'items': [{'name': 'Apple', 'quantity': 4}, {'name': 'T-Shirt', 'quantity': 1}]}
+        with app.app_context():
+            assert Purchase.query.count() == 5
+
+    response = client.post('/checkout', json={'items': [{'name': 'Apple', 'quantity': 0}]}, headers={'Authorization': token})
+    assert response.status_code == 400
+
+def test_catalog_cache():
+    cache = CatalogCache(maxsize=2, ttl=5, stale_seconds=10)
+    now = [100.0]
+    fetch = MagicMock(side_effect=lambda: f'v{fetch.call_count}')
+    with patch('sales.app.time.monotonic', lambda: now[0]):
+        assert cache.get('a', fetch) == 'v1'
+        assert cache.get('a', fetch) == 'v1' and fetch.call_count == 1
+
+        now[0] += 6  # Stale: served at once and refreshed in the background
+        assert cache.get('a', fetch) == 'v1'
+        for _ in range(100):
+            if cache.stats()['refreshes']:
+                break
+            time.sleep(0.01)
+        assert cache.get('a', fetch) == 'v2'
+
+        now[0] += 60  # Too old to serve without a fetch, but better than an error
+        fetch.side_effect = CircuitBreakerError('open')
+        assert cache.get('a', fetch) == 'v2'
+        with pytest.raises(CircuitBreakerError):
+            cache.get('b', fetch)
+
+        fetch.side_effect = lambda: 'fresh'
+        cache.get('b', fetch)
+        cache.get('c', fetch)  # Evicts 'a', the least recently used
+        assert cache.get('a', fetch) == 'fresh'
+
+    stats = cache.stats()
+    assert stats['size'] == 2 and stats['evictions'] == 2
+    assert stats['hits'] == 2 and stats['stale_hits'] == 1 and stats['errors_served_stale'] == 1
+
+
+def test_display_goods_served_when_inventory_is_down(client):
+    goods = [{'name': 'Apple', 'category': 'food', 'price_per_item': 1.0, 'description': '', 'count_in_stock': 10}]
+    with patch('sales.app.requests.Session.get') as mock_get:
+        mock_get.return_value = MagicMock(status_code=200, json=MagicMock(return_value=goods))
+        assert client.get('/goods').get_json() == [{'name': 'Apple', 'price_per_item': 1.0}]
+        assert client.get('/goods').get_json() == [{'name': 'Apple', 'price_per_item': 1.0}]
+        assert mock_get.call_count == 1
+
+        catalog_cache.ttl = catalog_cache.stale_seconds = 0
+        mock_get.side_effect = CircuitBreakerError('open')
+        try:
+            response = client.get('/goods')
+        finally:
+            catalog_cache.ttl = app.config['CATALOG_CACHE_TTL']
+            catalog_cache.stale_seconds = app.config['CATALOG_CACHE_STALE_SECONDS']
+        assert response.status_code == 200
+        assert response.get_json() == [{'name': 'Apple', 'price_per_item': 1.0}]
+
+def test_catalog_replica(client):
+    snapshot = {'seq': 4, 'goods': [
+        {'id': 1, 'name': 'Apple', 'category': 'food', 'price_per_item': 1.0, 'description': '', 'count_in_stock': 10},
+        {'id': 2, 'name': 'Laptop', 'category': 'electronics', 'price_per_item': 1000.0, 'description': '', 'count_in_stock': 2},
+    ]}
+    feed = {'last_seq': 7, 'changes': [
+        {'seq': 5, 'kind': 'stock', 'good_id': None, 'name': 'Apple', 'good': {'count_in_stock': 0}},
+        {'seq': 6, 'kind': 'update', 'good_id': 2, 'name': 'Notebook',
+         'good': dict(snapshot['goods'][1], name='Notebook')},
+        {'seq': 7, 'kind': 'create', 'good_id': 3, 'name': 'T-Shirt',
+         'good': {'id': 3, 'name': 'T-Shirt', 'category': 'clothes', 'price_per_item': 20.0, 'description': '', 'count_in_stock': 5}},
+    ]}
+
+    def side_effect_get(url, *args, **kwargs):
+        response = MagicMock()
+        response.status_code = 200
+        if url == 'http://inventory:5001/goods/snapshot':
+            response.json.return_value = snapshot
+        elif url == 'http://inventory:5001/goods/changes':
+            assert kwargs['params']['since'] == 4
+            response.json.return_value = feed
+        else:
+            raise ValueError('Unmocked url in get: ' + url)
+        return response
+
+    try:
+        with patch('sales.app.requests.Session.get') as mock_get:
+            mock_get.side_effect = side_effect_get
+            assert not catalog_replica.ready
+            catalog_replica.load_snapshot()
+            catalog_replica.poll()
+            assert catalog_replica.ready and catalog_replica.seq == 7
+
+            # Reads are now served locally
+            mock_get.reset_mock()
+            assert client.get('/goods').get_json() == [
+                {'name': 'Notebook', 'price_per_item': 1000.0},
+                {'name': 'T-Shirt', 'price_per_item': 20.0},
+            ]
+            assert client.get('/goods/Laptop').status_code == 404
+            assert client.get('/goods/Notebook').get_json()['count_in_stock'] == 2
+            response = client.post('/sale', data=json.dumps({'name': 'Apple'}), content_type='application/json',
+                                   headers={'Authorization': create_token('testuser')})
+            assert response.get_json()['error'] == 'Good is out of stock'
+            mock_get.assert_not_called()
+
+            catalog_replica.apply({'seq': 8, 'kind': 'delete', 'good_id': 2, 'name': 'Notebook', 'good': None})
+            assert catalog_replica.get('Notebook') is None
+            assert catalog_replica.stats()['changes_applied'] == 4
+    finally:
+        catalog_replica.last_sync = catalog_replica.seq = None